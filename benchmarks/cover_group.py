@@ -0,0 +1,112 @@
+"""Latency of moving a group of HomeGW covers.
+
+Sets the position of 50 HomeMQTTCover at once, the way a service call on a
+group does, against an MQTT stand-in (relays report they switched on and
+off right after each move) and reports the messages published and
+the time from the service call to the last publish, and from the first to
+the last publish (how staggered the relays are):
+
+  unbatched  each cover publishes and writes its state when called
+  burst      the relays are switched back to back in the next iteration
+  combined   one message to batch_topic switches all relays
+
+Needs voluptuous, run from the repository root:
+
+    python benchmarks/cover_group.py
+"""
+import asyncio
+import os
+import statistics
+import sys
+import time
+
+from hass_standin import Hass, install_standin
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+COVERS = 50
+ROUNDS = 200
+BATCH_TOPIC = 'devices/m-duino/relays/set'
+
+
+async def async_setup_covers(hass, cover):
+    """Add COVERS covers on relays 1 to 2 * COVERS."""
+    covers = []
+    config = {cover.CONF_COVERS: {
+        'blind_{}'.format(index): {
+            cover.CONF_RELAY_UP: 2 * index + 1,
+            cover.CONF_RELAY_DOWN: 2 * index + 2,
+            cover.CONF_DELAY_TIME: 30000,
+        } for index in range(COVERS)},
+        cover.CONF_FRAME_RATE: cover.DEFAULT_FRAME_RATE}
+    await cover.async_setup_platform(hass, config, covers.extend)
+    for entity in covers:
+        await entity.async_added_to_hass()
+    return covers
+
+
+async def async_run(mode):
+    """Move all covers ROUNDS times.
+
+    Returns the messages per move and the (latency, spread) of each move.
+    """
+    from homegw import cover
+
+    hass = Hass(asyncio.get_event_loop())
+    covers = await async_setup_covers(hass, cover)
+    router = await cover.async_get_relay_router(hass)
+    if mode == 'combined':
+        router.batch_topic = BATCH_TOPIC
+    elif mode == 'unbatched':
+        operate = router.async_operate
+
+        def async_operate(*args):
+            """Publish and write the state right away."""
+            operate(*args)
+            router._async_flush()
+        router.async_operate = async_operate
+
+    mqtt = hass.components.mqtt
+    published = mqtt.async_publish
+    publish_times = []
+
+    def async_publish(*args, **kwargs):
+        """Publish and keep the time."""
+        published(*args, **kwargs)
+        publish_times.append(time.perf_counter())
+    mqtt.async_publish = async_publish
+
+    timings = []
+    for lap in range(ROUNDS):
+        position = 100 if lap % 2 else 0
+        publish_times.clear()
+        called = time.perf_counter()
+        await asyncio.gather(*(entity.async_set_cover_position(
+            position=position) for entity in covers))
+        await asyncio.sleep(0)
+        timings.append((publish_times[-1] - called,
+                        publish_times[-1] - publish_times[0]))
+        for entity in covers:
+            relay = cover.M_DUINO_RELAY.format(entity._moving_relay)
+            mqtt.receive(relay, 'true')
+            mqtt.receive(relay, 'false')
+        await asyncio.sleep(0)
+    assert all(entity.writes == 3 * ROUNDS for entity in covers)
+    return len(mqtt.published) / ROUNDS, timings
+
+
+def main():
+    """Time every mode."""
+    sys.path.insert(0, ROOT)
+    install_standin()
+    for mode in ('unbatched', 'burst', 'combined'):
+        messages, timings = asyncio.run(async_run(mode))
+        latencies, spreads = zip(*timings)
+        print("{:10} {:3.0f} messages, {:6.1f} us to the last publish "
+              "(p90 {:6.1f}), {:6.1f} us first to last".format(
+                  mode, messages, 1e6 * statistics.median(latencies),
+                  1e6 * sorted(latencies)[len(latencies) * 9 // 10],
+                  1e6 * statistics.median(spreads)))
+
+
+if __name__ == '__main__':
+    main()
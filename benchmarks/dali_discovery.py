@@ -0,0 +1,191 @@
+"""Compare the DALI discovery modes on a simulated bus.
+
+Runs dali/light.py scan_gears (QueryControlGearPresent on every short
+address below max_gears) and search_gears (random address binary search)
+against a simulated bus of gears with random short addresses. Reports the
+frames sent and the bus time they take at 1200 baud, then has the search
+give short addresses to new gears while two gears pick the same random
+address. Needs python-dali and voluptuous, run from the repository root:
+
+    python benchmarks/dali_discovery.py
+"""
+import importlib.util
+import os
+import random
+
+from hass_standin import install_standin
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MAX_GEARS = 64
+GEAR_COUNTS = (0, 1, 2, 4, 16, 40, 64)
+
+TE = 1 / 2400
+FORWARD_FRAME = 38 * TE + 22 * TE
+ANSWER = 22 * TE + 22 * TE
+DRIVER_DELAY = 0.02
+
+
+class Gear(object):
+    """A simulated control gear, short_address None if it has none."""
+
+    def __init__(self, short_address, level=254, device_type=6):
+        """Initialize."""
+        self.short_address = short_address
+        self.level = level
+        self.device_type = device_type
+        self.groups = set()
+        self.random_address = 0xffffff
+        self.initialised = self.withdrawn = False
+
+
+class SimulatedBus(object):
+    """Answers the commands used for discovery like the gears on a bus.
+
+    Responses are the ones of python-dali, built from the backward frames
+    the gears would send.
+    """
+
+    def __init__(self, gears, broken=(), collisions=0):
+        """Initialize with gears and short addresses that raise errors.
+
+        The first collisions Randomise give two gears the same address.
+        """
+        self.gears = gears
+        self.broken = set(broken)
+        self.collisions = collisions
+        self.search_address = [0, 0, 0]
+        self.frames = 0
+        self.bus_time = 0
+        self.rnd = random.Random(1200)
+
+    def send(self, command):
+        """Handle command, returns its response."""
+        from dali import frame
+        from dali.address import Short
+        import dali.gear.general as gear
+
+        self.frames += 2 if command.sendtwice else 1
+        self.bus_time += (FORWARD_FRAME + DRIVER_DELAY) * (
+            2 if command.sendtwice else 1)
+        answers = []
+        if isinstance(command, gear.QueryControlGearPresent):
+            if isinstance(command.destination, Short):
+                if command.destination.address in self.broken:
+                    raise IOError("no ack")
+                answers = [0xff for g in self.gears
+                           if g.short_address == command.destination.address]
+            else:
+                answers = [0xff for g in self.gears]
+        elif isinstance(command, (gear.QueryActualLevel, gear.QueryDeviceType,
+                                  gear.QueryGroupsZeroToSeven,
+                                  gear.QueryGroupsEightToFifteen)):
+            for g in self.gears:
+                if g.short_address != command.destination.address:
+                    continue
+                if isinstance(command, gear.QueryActualLevel):
+                    answers.append(g.level)
+                elif isinstance(command, gear.QueryDeviceType):
+                    answers.append(g.device_type)
+                else:
+                    shift = (0 if isinstance(command, gear.QueryGroupsZeroToSeven)
+                             else 8)
+                    answers.append(sum(1 << (group - shift)
+                                       for group in g.groups
+                                       if shift <= group < shift + 8))
+        elif isinstance(command, gear.Terminate):
+            for g in self.gears:
+                g.initialised = False
+        elif isinstance(command, gear.Initialise):
+            for g in self.gears:
+                if command.broadcast or g.short_address is None:
+                    g.initialised = True
+                    g.withdrawn = False
+        elif isinstance(command, gear.Randomise):
+            self.bus_time += 0.1
+            initialised = [g for g in self.gears if g.initialised]
+            for g in initialised:
+                g.random_address = self.rnd.getrandbits(24)
+            if self.collisions and len(initialised) > 1:
+                self.collisions -= 1
+                initialised[1].random_address = initialised[0].random_address
+        elif isinstance(command, (gear.SetSearchAddrH, gear.SetSearchAddrM,
+                                  gear.SetSearchAddrL)):
+            index = (gear.SetSearchAddrH, gear.SetSearchAddrM,
+                     gear.SetSearchAddrL).index(type(command))
+            self.search_address[index] = command.param
+        else:
+            search = (self.search_address[0] << 16 |
+                      self.search_address[1] << 8 | self.search_address[2])
+            selected = [g for g in self.gears
+                        if g.initialised and g.random_address == search]
+            if isinstance(command, gear.Compare):
+                answers = [0xff for g in self.gears
+                           if g.initialised and not g.withdrawn and
+                           g.random_address <= search]
+            elif isinstance(command, gear.QueryShortAddress):
+                answers = [0xff if g.short_address is None else
+                           g.short_address << 1 | 1 for g in selected]
+            elif isinstance(command, gear.ProgramShortAddress):
+                for g in selected:
+                    g.short_address = command.address
+            elif isinstance(command, gear.VerifyShortAddress):
+                answers = [0xff for g in self.gears if g.initialised and
+                           g.short_address == command.address]
+            elif isinstance(command, gear.Withdraw):
+                for g in selected:
+                    g.withdrawn = True
+
+        if command.response is None:
+            return None
+        self.bus_time += ANSWER
+        if not answers:
+            return command.response(None)
+        if len(answers) > 1:
+            return command.response(frame.BackwardFrameError(answers[0]))
+        return command.response(frame.BackwardFrame(answers[0]))
+
+
+def main():
+    """Discover growing numbers of gears with both modes."""
+    install_standin()
+    spec = importlib.util.spec_from_file_location(
+        'dali_light', os.path.join(ROOT, 'dali', 'light.py'))
+    light = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(light)
+    light.RANDOMISE_DELAY = 0
+
+    rnd = random.Random(64)
+    print("gears        scan: frames     s   search: frames     s")
+    for count in GEAR_COUNTS:
+        addresses = rnd.sample(range(MAX_GEARS), count)
+        results = []
+        for discover in (lambda bus: light.scan_gears(bus, MAX_GEARS),
+                         light.search_gears):
+            bus = SimulatedBus([Gear(address) for address in addresses])
+            found = discover(bus)
+            assert sorted(addresses) == [lamp.address for lamp in found]
+            results.append((bus.frames, bus.bus_time))
+        print("{:5}   {:14} {:6.2f}   {:14} {:6.2f}".format(
+            count, results[0][0], results[0][1], results[1][0],
+            results[1][1]))
+
+    addresses = rnd.sample(range(MAX_GEARS), 8)
+    bus = SimulatedBus([Gear(address) for address in addresses],
+                       broken=[min(addresses) + 1])
+    found = light.scan_gears(bus, MAX_GEARS)
+    print("scan with a failing address: found {} of {}".format(
+        len(found), len(addresses)))
+
+    gears = [Gear(address) for address in addresses] + [Gear(None), Gear(None)]
+    bus = SimulatedBus(gears, collisions=2)
+    found = light.search_gears(bus)
+    assert [lamp.address for lamp in found] == sorted(
+        g.short_address for g in gears)
+    print("search with 2 new gears and 2 collisions: found {} of {} in {} "
+          "frames {:.2f} s, new gears at {}".format(
+              len(found), len(gears), bus.frames, bus.bus_time,
+              [g.short_address for g in gears[-2:]]))
+
+
+if __name__ == '__main__':
+    main()
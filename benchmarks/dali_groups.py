@@ -0,0 +1,145 @@
+"""Frames and ripple of DALI scenes.
+
+Plays scenes (lights set to the same level at once, the way a light group
+or a scene does) ROUNDS times on a bus of 40 simulated gears and reports,
+per scene, the frames sent and the ripple: the bus time from the first to
+the last light of the scene changing.
+
+  individual  every light sends its own DAPC, as before LevelBatcher
+  batched     LevelBatcher, one broadcast or group frame per level
+
+Group set up frames (AddToGroup/RemoveFromGroup, sent twice) are counted
+apart. Needs python-dali and voluptuous, run from the repository root:
+
+    python benchmarks/dali_groups.py
+"""
+import asyncio
+import importlib.util
+import os
+import random
+
+from dali_discovery import DRIVER_DELAY, FORWARD_FRAME, Gear, SimulatedBus
+from hass_standin import Hass, install_standin
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+GEARS = 40
+ROUNDS = 5
+
+
+class GroupBus(SimulatedBus):
+    """A simulated bus whose gears take levels and join groups."""
+
+    def __init__(self, gears):
+        """Initialize."""
+        super().__init__(gears)
+        self.changed = {}
+        self.setup_frames = 0
+
+    def send(self, command):
+        """Handle command, keeping when each gear changed level."""
+        from dali.address import Broadcast, Group, Short
+        import dali.gear.general as gear
+
+        if not isinstance(command, (gear.DAPC, gear.Off, gear.AddToGroup,
+                                    gear.RemoveFromGroup)):
+            return super().send(command)
+        self.frames += 2 if command.sendtwice else 1
+        self.bus_time += (FORWARD_FRAME + DRIVER_DELAY) * (
+            2 if command.sendtwice else 1)
+        destination = command.destination
+        if isinstance(destination, Broadcast):
+            gears = self.gears
+        elif isinstance(destination, Group):
+            gears = [g for g in self.gears if destination.group in g.groups]
+        elif isinstance(destination, Short):
+            gears = [g for g in self.gears
+                     if g.short_address == destination.address]
+        if isinstance(command, gear.AddToGroup):
+            self.setup_frames += 2
+            for g in gears:
+                g.groups.add(command.param)
+        elif isinstance(command, gear.RemoveFromGroup):
+            self.setup_frames += 2
+            for g in gears:
+                g.groups.discard(command.param)
+        else:
+            for g in gears:
+                self.changed[g.short_address] = self.bus_time
+        return None
+
+
+async def async_run(light, mode):
+    """Play the scenes, returns {scene: [(frames, ripple), ...]}."""
+    from dali.address import Short
+    from dali.gear.general import DAPC, Off
+
+    hass = Hass(asyncio.get_event_loop())
+    addresses = list(range(GEARS))
+    gears = [Gear(address) for address in addresses]
+    bus = GroupBus(gears)
+    inventory = light.GearInventory(hass, None, 'benchmark')
+    inventory.gears = {address: {light.ATTR_DEVICE_TYPE: 6,
+                                 light.ATTR_LEVEL: 0, light.ATTR_GROUPS: []}
+                       for address in addresses}
+    scheduler = light.BusScheduler(hass, bus)
+    scheduler.async_start()
+    batcher = light.LevelBatcher(hass, scheduler, inventory)
+    lights = [light.DALILight(scheduler, batcher, 'benchmark', Short(address),
+                              inventory) for address in addresses]
+
+    rnd = random.Random(20)
+    scenes = {
+        'half on': (addresses[:20], 200),
+        'all off': (addresses, None),
+        'other half': (addresses[20:], 100),
+        'ten lights': (rnd.sample(addresses, 10), 50),
+    }
+
+    async def async_set(entity, level):
+        """Set the level of entity, as before or through the batcher."""
+        if mode == 'batched':
+            if level is None:
+                await entity.async_turn_off()
+            else:
+                await entity.async_turn_on(brightness=level)
+        else:
+            await scheduler.async_send(
+                Off(entity.addr) if level is None else DAPC(entity.addr, level))
+
+    results = {scene: [] for scene in scenes}
+    for _ in range(ROUNDS):
+        for scene, (members, level) in scenes.items():
+            bus.changed.clear()
+            frames = bus.frames - bus.setup_frames
+            await asyncio.gather(*(async_set(lights[address], level)
+                                   for address in members))
+            changed = [bus.changed[address] for address in members]
+            results[scene].append((bus.frames - bus.setup_frames - frames,
+                                   max(changed) - min(changed)))
+            # Let the groups being set up finish before the next scene
+            while scheduler.queue_depth or batcher._programming:
+                await asyncio.sleep(0.001)
+    scheduler.async_stop()
+    return results, bus.setup_frames
+
+
+def main():
+    """Play the scenes in both modes."""
+    install_standin()
+    spec = importlib.util.spec_from_file_location(
+        'dali_light', os.path.join(ROOT, 'dali', 'light.py'))
+    light = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(light)
+
+    for mode in ('individual', 'batched'):
+        results, setup_frames = asyncio.run(async_run(light, mode))
+        print("{} ({} group set up frames)".format(mode, setup_frames))
+        for scene, rounds in results.items():
+            print("  {:11} frames {:12}  ripple ms {}".format(
+                scene, " ".join(str(frames) for frames, _ in rounds),
+                " ".join("{:.0f}".format(1000 * ripple)
+                         for _, ripple in rounds)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,147 @@
+"""Latency of DALI light commands while the bus is busy.
+
+Turns a light on every USER_INTERVAL seconds while a bus of 40 simulated
+gears is busy with a discovery (scan and query every gear, as on startup)
+or a refresh (update every light at once), and reports how long the user
+commands took:
+
+  lock       the driver behind a threading.RLock, as before BusScheduler
+  scheduler  BusScheduler, user commands go before queries and discovery
+
+The simulated bus sleeps SCALE times the time the frames take at 1200
+baud. Needs python-dali and voluptuous, run from the repository root:
+
+    python benchmarks/dali_scheduler.py
+"""
+import asyncio
+import functools
+import importlib.util
+import os
+import random
+import statistics
+import threading
+import time
+
+from dali_discovery import FORWARD_FRAME, Gear, SimulatedBus
+from hass_standin import Hass, install_standin
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+GEARS = 40
+MAX_GEARS = 64
+SCALE = 0.1
+USER_INTERVAL = 10 * FORWARD_FRAME * SCALE
+
+
+class SleepingBus(SimulatedBus):
+    """A simulated bus that takes (scaled) bus time to answer."""
+
+    def send(self, command):
+        """Handle command, sleeping for the time its frames take."""
+        bus_time = self.bus_time
+        try:
+            return super().send(command)
+        finally:
+            time.sleep((self.bus_time - bus_time) * SCALE)
+
+
+async def async_user(light, busy, send):
+    """Turn the light on every USER_INTERVAL while busy, returns latencies."""
+    from dali.gear.general import DAPC
+
+    latencies = []
+    level = 0
+    while not busy.done():
+        level = level % 254 + 1
+        called = time.perf_counter()
+        await send(DAPC(light.addr, level))
+        latencies.append(time.perf_counter() - called)
+        await asyncio.sleep(USER_INTERVAL)
+    return latencies
+
+
+async def async_run(light, mode, workload):
+    """Run workload and user commands, returns (latencies, workload time)."""
+    from dali.address import Short
+    from dali.gear.general import QueryActualLevel
+
+    hass = Hass(asyncio.get_event_loop())
+    addresses = random.Random(40).sample(range(MAX_GEARS), GEARS)
+    bus = SleepingBus([Gear(address) for address in addresses])
+    discover = functools.partial(light.scan_gears, max_gears=MAX_GEARS)
+    inventory = light.GearInventory(hass, None, 'benchmark')
+    inventory.gears = {address: {light.ATTR_DEVICE_TYPE: None,
+                                 light.ATTR_LEVEL: None}
+                       for address in addresses}
+
+    scheduler = light.BusScheduler(hass, bus)
+    scheduler.async_start()
+    batcher = light.LevelBatcher(hass, scheduler, inventory)
+    lights = {address: light.DALILight(scheduler, batcher, 'benchmark',
+                                       Short(address), inventory)
+              for address in addresses}
+
+    if mode == 'lock':
+        lock = threading.RLock()
+
+        def locked_send(command):
+            """Send command holding the driver lock."""
+            with lock:
+                return bus.send(command)
+
+        def verify():
+            """Discover and query holding the lock, like the lights did."""
+            with lock:
+                ballasts = discover(bus)
+            for ballast in ballasts:
+                with lock:
+                    light.query_gear(bus, ballast)
+
+        async def async_send(command):
+            """Send command in the executor."""
+            return await hass.async_add_executor_job(locked_send, command)
+
+        if workload == 'discovery':
+            busy = hass.async_add_executor_job(verify)
+        else:
+            busy = asyncio.gather(*(async_send(QueryActualLevel(Short(address)))
+                                    for address in addresses))
+    else:
+        async_send = scheduler.async_send
+        if workload == 'discovery':
+            busy = light.async_verify_inventory(
+                hass, light.QueuedDriver(scheduler, light.PRIORITY_DISCOVERY),
+                discover, inventory, lights, None, lambda new_lights: None)
+        else:
+            busy = asyncio.gather(*(entity.async_update()
+                                    for entity in lights.values()))
+
+    started = time.perf_counter()
+    busy = asyncio.ensure_future(busy)
+    latencies = await async_user(lights[addresses[0]], busy, async_send)
+    await busy
+    elapsed = time.perf_counter() - started
+    scheduler.async_stop()
+    return latencies, elapsed
+
+
+def main():
+    """Time user commands under every mode and workload."""
+    install_standin()
+    spec = importlib.util.spec_from_file_location(
+        'dali_light', os.path.join(ROOT, 'dali', 'light.py'))
+    light = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(light)
+
+    for workload in ('discovery', 'refresh'):
+        for mode in ('lock', 'scheduler'):
+            latencies, elapsed = asyncio.run(async_run(light, mode, workload))
+            latencies.sort()
+            print("{:9} {:9} {:6.2f}s busy, {:3} commands, {:7.1f} ms median "
+                  "(max {:7.1f}) per command".format(
+                      workload, mode, elapsed, len(latencies),
+                      1000 * statistics.median(latencies),
+                      1000 * latencies[-1]))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,126 @@
+"""Frames and lag of a DALI brightness slider.
+
+Drags a slider on one light (a level every SLIDER_INTERVAL seconds for
+SLIDER_STEPS steps) while another light is switched every
+SWITCH_INTERVAL, on a simulated bus taking the time of 1200 baud frames,
+and reports the frames sent for the slider, the time from its last step
+to that level on the bus and the median time to switch the other light:
+
+  every      every level is sent, as before the latest value wins
+  latest     LevelBatcher, a level waiting for the bus is replaced
+
+Needs python-dali and voluptuous, run from the repository root:
+
+    python benchmarks/dali_slider.py
+"""
+import asyncio
+import importlib.util
+import os
+import statistics
+import time
+
+from dali_discovery import DRIVER_DELAY, FORWARD_FRAME, Gear, SimulatedBus
+from hass_standin import Hass, install_standin
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SLIDER_STEPS = 50
+SLIDER_INTERVAL = 0.02
+SWITCH_INTERVAL = 0.1
+
+
+class SliderBus(SimulatedBus):
+    """A simulated bus that takes the time of each DAPC frame."""
+
+    def __init__(self, gears):
+        """Initialize."""
+        super().__init__(gears)
+        self.levels = {}
+
+    def send(self, command):
+        """Apply a DAPC, sleeping for the time its frame takes."""
+        import dali.gear.general as gear
+
+        if not isinstance(command, gear.DAPC):
+            return super().send(command)
+        time.sleep(FORWARD_FRAME + DRIVER_DELAY)
+        self.frames += 1
+        self.levels[command.destination.address] = (
+            command.power, time.perf_counter())
+        return None
+
+
+async def async_run(light, mode):
+    """Drag the slider, returns (slider frames, lag, switch latencies)."""
+    from dali.address import Short
+    from dali.gear.general import DAPC
+
+    hass = Hass(asyncio.get_event_loop())
+    bus = SliderBus([Gear(0), Gear(1)])
+    inventory = light.GearInventory(hass, None, 'benchmark')
+    inventory.gears = {address: {light.ATTR_DEVICE_TYPE: 6,
+                                 light.ATTR_LEVEL: 0, light.ATTR_GROUPS: []}
+                       for address in (0, 1)}
+    scheduler = light.BusScheduler(hass, bus)
+    scheduler.async_start()
+    batcher = light.LevelBatcher(hass, scheduler, inventory)
+    slider, switch = [light.DALILight(scheduler, batcher, 'benchmark',
+                                      Short(address), inventory)
+                      for address in (0, 1)]
+
+    async def async_set(entity, level):
+        """Set the level of entity, every level or through the batcher."""
+        if mode == 'latest':
+            await entity.async_turn_on(brightness=level)
+        else:
+            await scheduler.async_send(DAPC(entity.addr, level))
+
+    async def async_switch(done):
+        """Switch the other light until the slider is done."""
+        latencies = []
+        level = 1
+        while not done.is_set():
+            level = 255 - level
+            called = time.perf_counter()
+            await async_set(switch, level)
+            latencies.append(time.perf_counter() - called)
+            await asyncio.sleep(SWITCH_INTERVAL)
+        return latencies
+
+    done = asyncio.Event()
+    switching = asyncio.ensure_future(async_switch(done))
+    steps = []
+    for step in range(SLIDER_STEPS):
+        steps.append(asyncio.ensure_future(async_set(slider, step + 1)))
+        await asyncio.sleep(SLIDER_INTERVAL)
+    last_step = time.perf_counter() - SLIDER_INTERVAL
+    await asyncio.gather(*steps)
+    done.set()
+    latencies = await switching
+    scheduler.async_stop()
+
+    level, landed = bus.levels[0]
+    assert level == SLIDER_STEPS
+    slider_frames = bus.frames - len(latencies)
+    return slider_frames, landed - last_step, latencies, batcher
+
+
+def main():
+    """Drag the slider in both modes."""
+    install_standin()
+    spec = importlib.util.spec_from_file_location(
+        'dali_light', os.path.join(ROOT, 'dali', 'light.py'))
+    light = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(light)
+
+    for mode in ('every', 'latest'):
+        frames, lag, latencies, batcher = asyncio.run(async_run(light, mode))
+        print("{:6} {:3} slider frames, last level on the bus {:6.0f} ms after "
+              "the last step, {:3} coalesced, other light {:5.0f} ms "
+              "median".format(
+                  mode, frames, 1000 * lag,
+                  batcher.coalesced_commands[0] if mode == 'latest' else 0,
+                  1000 * statistics.median(latencies)))
+
+
+if __name__ == '__main__':
+    main()
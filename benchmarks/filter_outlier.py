@@ -0,0 +1,71 @@
+"""Micro-benchmark of the outlier filter.
+
+Compares the outlier filter of the filter sensor (median recomputed over the
+whole window for every sample) with filter_helper's OutlierBank (sorted
+window). Needs Home Assistant installed, run from the repository root:
+
+    python benchmarks/filter_outlier.py
+"""
+import os
+import random
+import sys
+import timeit
+from datetime import datetime, timezone
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from filter_helper import OutlierBank  # noqa: E402
+from homeassistant.components.filter.sensor import OutlierFilter  # noqa: E402
+
+SAMPLES = 20000
+WINDOWS = (3, 31, 301)
+
+
+class State(object):
+    """Sample as expected by the filter sensor filters."""
+
+    def __init__(self, value):
+        """Keep value and timestamp."""
+        self.last_updated = datetime.now(timezone.utc)
+        self.state = value
+
+
+def samples(count):
+    """Return noisy temperature readings with some spikes."""
+    rnd = random.Random(433)
+    return [20 + rnd.gauss(0, 0.5) + (15 if rnd.random() < 0.02 else 0)
+            for _ in range(count)]
+
+
+def run_filter_sensor(values, window_size):
+    """Feed values through the filter sensor outlier filter."""
+    outlier = OutlierFilter(window_size=window_size, precision=2,
+                            entity="benchmark", radius=2.0)
+    for value in values:
+        outlier.filter_state(State(value))
+
+
+def run_bank(values, window_size):
+    """Feed values through a row of OutlierBank."""
+    bank = OutlierBank(window_size=window_size, precision=2, radius=2.0)
+    row = bank.allocate()
+    for value in values:
+        bank.update(row, value, 0)
+
+
+def main():
+    """Run the benchmark."""
+    values = samples(SAMPLES)
+    print("{:>7} {:>14} {:>14} {:>8}".format(
+        "window", "filter sensor", "OutlierBank", "speedup"))
+    for window_size in WINDOWS:
+        before = min(timeit.repeat(
+            lambda: run_filter_sensor(values, window_size), number=1, repeat=3))
+        after = min(timeit.repeat(
+            lambda: run_bank(values, window_size), number=1, repeat=3))
+        print("{:>7} {:>11.2f} us {:>11.2f} us {:>7.1f}x".format(
+            window_size, before / SAMPLES * 1e6, after / SAMPLES * 1e6,
+            before / after))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,278 @@
+"""Minimal stand-in of Home Assistant for the benchmarks.
+
+install_standin() puts modules with just what the platforms of this
+repository import in sys.modules, so their ingest and command paths can be
+timed without Home Assistant (voluptuous is still needed for the schemas).
+Nothing is persisted and listeners are never called.
+"""
+import sys
+import types
+from datetime import datetime, timedelta, timezone
+
+
+def callback(func):
+    """Stand-in of homeassistant.core.callback."""
+    return func
+
+
+def remove_nothing():
+    """Returned by the stand-in listeners."""
+
+
+def utcnow():
+    """Stand-in of homeassistant.util.dt.utcnow."""
+    return datetime.now(timezone.utc)
+
+
+class Bus(object):
+    """Stand-in of the event bus, events are never fired."""
+
+    def async_listen_once(self, event_type, listener):
+        """Ignore the listener."""
+        return remove_nothing
+
+
+class Message(object):
+    """Stand-in of a received MQTT message."""
+
+    def __init__(self, topic, payload):
+        """Initialize."""
+        self.topic = topic
+        self.payload = payload
+
+
+class MQTT(object):
+    """Stand-in of the MQTT component, keeps what is published."""
+
+    def __init__(self):
+        """Initialize."""
+        self.published = []
+        self.subscriptions = []
+
+    def async_publish(self, topic, payload, qos=0, retain=False):
+        """Record the message, encoded as paho would."""
+        self.published.append((topic, str(payload).encode(), qos, retain))
+
+    async def async_subscribe(self, topic, msg_callback):
+        """Record the subscription."""
+        self.subscriptions.append((topic, msg_callback))
+        return remove_nothing
+
+    def receive(self, topic, payload):
+        """Deliver a message to the subscriptions matching topic."""
+        for subscription, msg_callback in self.subscriptions:
+            prefix, _, wildcard = subscription.rpartition('/')
+            if subscription == topic or (
+                    wildcard == '+' and topic.startswith(prefix + '/') and
+                    '/' not in topic[len(prefix) + 1:]):
+                msg_callback(Message(topic, payload))
+
+
+class Hass(object):
+    """Stand-in of HomeAssistant."""
+
+    def __init__(self, loop):
+        """Initialize."""
+        self.loop = loop
+        self.data = {}
+        self.bus = Bus()
+        self.components = types.SimpleNamespace(mqtt=MQTT())
+
+    def async_create_task(self, target):
+        """Schedule a coroutine."""
+        return self.loop.create_task(target)
+
+    def async_add_executor_job(self, target, *args):
+        """Run target in the default executor."""
+        return self.loop.run_in_executor(None, target, *args)
+
+
+class Store(object):
+    """Stand-in of homeassistant.helpers.storage.Store, keeps nothing."""
+
+    def __init__(self, hass, version, key):
+        """Initialize."""
+
+    async def async_load(self):
+        """Return no data."""
+        return None
+
+    async def async_save(self, data):
+        """Drop data."""
+
+
+class Entity(object):
+    """Stand-in of Entity, counts and renders the state writes."""
+
+    hass = None
+    entity_id = None
+    writes = 0
+
+    def schedule_update_ha_state(self, force_refresh=False):
+        """Count the write and render state and attributes like HA does."""
+        self.writes += 1
+        self.state
+        self.device_state_attributes
+
+    async_schedule_update_ha_state = schedule_update_ha_state
+
+    @property
+    def device_state_attributes(self):
+        """Return no attributes."""
+        return None
+
+
+class ClimateDevice(Entity):
+    """Stand-in of ClimateDevice."""
+
+    @property
+    def state(self):
+        """Return the current operation."""
+        return self.current_operation
+
+
+class WeatherEntity(Entity):
+    """Stand-in of WeatherEntity."""
+
+    @property
+    def state(self):
+        """Return the condition."""
+        return self.condition
+
+    @property
+    def state_attributes(self):
+        """Return the measurements."""
+        return {'temperature': self.temperature, 'humidity': self.humidity,
+                'pressure': self.pressure}
+
+
+class Light(Entity):
+    """Stand-in of Light."""
+
+    @property
+    def state(self):
+        """Return on or off."""
+        return 'on' if self.is_on else 'off'
+
+
+class CoverEntity(Entity):
+    """Stand-in of CoverEntity."""
+
+    @property
+    def state(self):
+        """Return open or closed."""
+        return 'closed' if self.is_closed else 'open'
+
+    @property
+    def device_state_attributes(self):
+        """Return the position."""
+        return {'current_position': self.current_cover_position}
+
+
+class RestoreEntity(Entity):
+    """Stand-in of RestoreEntity, there's nothing to restore."""
+
+    async def async_get_last_state(self):
+        """Return no state."""
+        return None
+
+    async def async_added_to_hass(self):
+        """Nothing to do."""
+
+    async def async_will_remove_from_hass(self):
+        """Nothing to do."""
+
+
+class HomeAssistantError(Exception):
+    """Stand-in of homeassistant.exceptions.HomeAssistantError."""
+
+
+def load_json(filename, default=None):
+    """Return no data."""
+    return {} if default is None else default
+
+
+def save_json(filename, data):
+    """Drop data."""
+
+
+async def async_get_last_state(hass, entity_id):
+    """Return no state."""
+    return None
+
+
+def install_standin():
+    """Put the Home Assistant stand-in modules in sys.modules."""
+    import voluptuous as vol
+    platform_schema = vol.Schema({}, extra=vol.ALLOW_EXTRA)
+    modules = {
+        'homeassistant': {},
+        'homeassistant.const': {
+            'EVENT_HOMEASSISTANT_STOP': 'homeassistant_stop',
+            'STATE_UNKNOWN': 'unknown', 'STATE_UNAVAILABLE': 'unavailable',
+            'STATE_ON': 'on', 'STATE_OPEN': 'open', 'STATE_CLOSED': 'closed',
+            'TEMP_CELSIUS': '°C', 'CONF_NAME': 'name',
+            'CONF_COVERS': 'covers', 'CONF_DELAY_TIME': 'delay_time',
+            'CONF_FRIENDLY_NAME': 'friendly_name',
+            'CONF_ID': 'id', 'CONF_DEVICES': 'devices',
+            'SUN_EVENT_SUNRISE': 'sunrise', 'SUN_EVENT_SUNSET': 'sunset',
+        },
+        'homeassistant.core': {'callback': callback},
+        'homeassistant.exceptions': {'HomeAssistantError': HomeAssistantError},
+        'homeassistant.util': {},
+        'homeassistant.util.dt': {'utcnow': utcnow},
+        'homeassistant.util.json': {'load_json': load_json, 'save_json': save_json},
+        'homeassistant.components': {},
+        'homeassistant.components.climate': {
+            'ClimateDevice': ClimateDevice, 'PLATFORM_SCHEMA': platform_schema,
+            'SUPPORT_TARGET_HUMIDITY_LOW': 16,
+            'ATTR_CURRENT_HUMIDITY': 'current_humidity',
+            'ATTR_CURRENT_TEMPERATURE': 'current_temperature',
+            'STATE_UNKNOWN': 'unknown', 'STATE_HEAT': 'heat',
+            'STATE_IDLE': 'idle',
+        },
+        'homeassistant.components.cover': {
+            'CoverEntity': CoverEntity, 'PLATFORM_SCHEMA': platform_schema,
+            'ATTR_POSITION': 'position',
+        },
+        'homeassistant.components.light': {
+            'Light': Light, 'PLATFORM_SCHEMA': platform_schema,
+            'ATTR_BRIGHTNESS': 'brightness', 'SUPPORT_BRIGHTNESS': 1,
+        },
+        'homeassistant.components.mqtt': {},
+        'homeassistant.components.weather': {
+            'WeatherEntity': WeatherEntity, 'PLATFORM_SCHEMA': platform_schema,
+        },
+        'homeassistant.helpers': {},
+        'homeassistant.helpers.config_validation': {
+            'string': str, 'positive_int': int, 'boolean': bool,
+            'entity_id': str, 'slug': str, 'time_period': timedelta,
+        },
+        'homeassistant.helpers.discovery': {},
+        'homeassistant.helpers.dispatcher': {
+            'async_dispatcher_send': lambda *args: None,
+            'async_dispatcher_connect': lambda *args: remove_nothing,
+        },
+        'homeassistant.helpers.event': {
+            'async_track_state_change': lambda *args: remove_nothing,
+            'async_track_time_interval': lambda *args: remove_nothing,
+            'async_track_point_in_utc_time': lambda *args: remove_nothing,
+            'track_utc_time_change': lambda *args, **kwargs: remove_nothing,
+        },
+        'homeassistant.helpers.restore_state': {
+            'RestoreEntity': RestoreEntity,
+            'async_get_last_state': async_get_last_state,
+        },
+        'homeassistant.helpers.storage': {'Store': Store},
+        'homeassistant.helpers.sun': {
+            'is_up': lambda hass: True,
+            'get_astral_event_next': lambda hass, event: None,
+        },
+    }
+    for name, attributes in modules.items():
+        module = types.ModuleType(name)
+        module.__dict__.update(attributes)
+        sys.modules[name] = module
+        parent, _, child = name.rpartition('.')
+        if parent:
+            setattr(sys.modules[parent], child, module)
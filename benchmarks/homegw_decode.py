@@ -0,0 +1,75 @@
+"""Micro-benchmark of the HomeGW frame decoder.
+
+Decodes a recording of gateway frames (homegw_frames.txt, duplicates and
+garbled lines included) with the generic json.loads and per-field
+conversions the entities used to do, and with homegw/frames.py (with and
+without the gateway layout regular expression). Doesn't need Home
+Assistant, run from the repository root:
+
+    python benchmarks/homegw_decode.py
+"""
+import importlib.util
+import json
+import os
+import timeit
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CORPUS = os.path.join(ROOT, 'benchmarks', 'homegw_frames.txt')
+REPEAT = 200
+
+spec = importlib.util.spec_from_file_location(
+    'frames', os.path.join(ROOT, 'homegw', 'frames.py'))
+frames = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(frames)
+
+
+def decode_json(raw):
+    """Decode raw the way the entities did before frames.py."""
+    try:
+        payload = json.loads(raw)
+        return (payload['dev'], float(payload['temp']), int(payload['hum']),
+                int(payload['id']), int(payload['ch']),
+                bool(payload['batt']), payload.get('pressure'))
+    except Exception:
+        return None
+
+
+def decode_all(decode, corpus):
+    """Decode every frame of the corpus, None for the rejected ones."""
+    decoded = []
+    for raw in corpus:
+        try:
+            decoded.append(decode(raw))
+        except ValueError:
+            decoded.append(None)
+    return decoded
+
+
+def main():
+    """Check the decoders agree and time them."""
+    with open(CORPUS) as corpus_file:
+        corpus = corpus_file.read().splitlines()
+
+    decoders = [
+        ('json.loads', decode_json),
+        ('frames', frames.decode),
+        ('frames, no regex', lambda raw: frames.frame_from_payload(
+            frames.loads(raw))),
+    ]
+    assert (decode_all(frames.decode, corpus) ==
+            decode_all(decoders[2][1], corpus) ==
+            decode_all(lambda raw: frames.decode(raw, json.loads), corpus))
+
+    print("{} frames, {} in the gateway layout, {} rejected, loads: {}".format(
+        len(corpus), sum(1 for raw in corpus if frames.FRAME_RE.fullmatch(raw)),
+        decode_all(frames.decode, corpus).count(None),
+        frames.loads.__module__))
+    for name, decode in decoders:
+        elapsed = timeit.timeit(
+            lambda: decode_all(decode, corpus), number=REPEAT)
+        print("{:16} {:6.2f} us/frame".format(
+            name, 1e6 * elapsed / REPEAT / len(corpus)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,145 @@
+"""Replay recorded HomeGW traffic into the HomeGW entities.
+
+Plays a log recorded with the homegw `record` option (or, with --text, a
+file of one frame per line) through the PayloadDispatcher into
+HomeGWClimate and HomeGWWeather entities, one per device found in the log.
+Home Assistant is replaced by a minimal stand-in, so this measures the
+ingest path alone: decoding, filters and deadbands. The dispatcher runs on
+the time of the log, so at any speed the duplicate window, filters and
+deadbands see the traffic as they did live. Needs voluptuous, run
+from the repository root:
+
+    python benchmarks/homegw_replay.py homegw.log --speed max
+    python benchmarks/homegw_replay.py benchmarks/homegw_frames.txt --text
+
+--burst N feeds the records N at a time, the way the gateway hub feeds a
+backlog read at once, with the latency reported per burst.
+"""
+import argparse
+import asyncio
+import logging
+import os
+import sys
+import time
+
+from hass_standin import Hass, install_standin
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TEXT_INTERVAL = 0.5
+
+
+def read_text(path):
+    """Yield the frames of a text file as TEXT_INTERVAL spaced records."""
+    with open(path) as text_file:
+        for index, line in enumerate(text_file):
+            yield index * TEXT_INTERVAL, line.strip()
+
+
+async def async_create_entities(hass, records, frames):
+    """Add an entity per device of the records, returns the entities."""
+    from filter_helper import EmissionGate
+    from homegw.climate import HomeGWClimate, VALUE_HOMEGW_DEV_DIGOO
+    from homegw.weather import HomeGWWeather, VALUE_HOMEGW_DEV_WEATHER
+
+    channels = set()
+    weather = False
+    for _, raw in records:
+        try:
+            frame = frames.decode(raw)
+        except ValueError:
+            continue
+        if frame.dev == VALUE_HOMEGW_DEV_DIGOO:
+            channels.add(frame.ch)
+        weather |= frame.dev == VALUE_HOMEGW_DEV_WEATHER
+
+    entities = [
+        HomeGWClimate(hass, "HomeGW thermostat {}".format(channel), None,
+                      None, channel, None, EmissionGate(max_interval=600))
+        for channel in sorted(channels)]
+    if weather:
+        entities.append(HomeGWWeather(hass, "HomeGW Weather Station", None,
+                                      EmissionGate(max_interval=600)))
+    for index, entity in enumerate(entities):
+        entity.hass = hass
+        entity.entity_id = 'replay.homegw_{}'.format(index)
+        await entity.async_added_to_hass()
+    return entities
+
+
+async def async_replay(records, speed, burst=1):
+    """Feed the records at speed (None for no delays), print the results."""
+    import homegw
+    from homegw import frames
+
+    hass = Hass(asyncio.get_event_loop())
+    entities = await async_create_entities(hass, records, frames)
+    dispatcher = homegw.async_get_dispatcher(hass, None)
+
+    log_time = [records[0][0]]
+    dispatcher.clock = lambda: log_time[0]
+
+    latencies = []
+    first = records[0][0]
+    start = time.monotonic()
+    for index in range(0, len(records), burst):
+        timestamp = records[index][0]
+        # A burst is received when its last frame is
+        log_time[0] = records[min(index + burst, len(records)) - 1][0]
+        if speed is not None:
+            delay = start + (timestamp - first) / speed - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+        fed = time.perf_counter()
+        if burst == 1:
+            dispatcher.async_feed(records[index][1])
+        else:
+            dispatcher.async_feed_many(
+                [raw for _, raw in records[index:index + burst]])
+        latencies.append(time.perf_counter() - fed)
+    elapsed = time.monotonic() - start
+
+    latencies.sort()
+    print("{} frames in {:.3f}s, {:.0f} frames/s, {} duplicates".format(
+        len(records), elapsed, len(records) / elapsed,
+        dispatcher.duplicates))
+    print("latency us: " + ", ".join(
+        "p{} {:.1f}".format(percentile, 1e6 * latencies[
+            min(len(latencies) - 1, len(latencies) * percentile // 100)])
+        for percentile in (50, 90, 99, 100)))
+    for entity in entities:
+        print("{:24} {:5} states written".format(entity.name, entity.writes))
+
+
+def main():
+    """Parse the arguments and replay."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('log')
+    parser.add_argument('--text', action='store_true',
+                        help="log is a text file of one frame per line")
+    parser.add_argument('--speed', default='max',
+                        help="playback speed (1 is real time) or max")
+    parser.add_argument('--repeat', type=int, default=1,
+                        help="play the log this many times")
+    parser.add_argument('--burst', type=int, default=1,
+                        help="feed this many frames at a time")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.ERROR)
+
+    sys.path.insert(0, ROOT)
+    install_standin()
+    from homegw import frames
+
+    records = list(read_text(args.log) if args.text else
+                   frames.read_log(args.log))
+    if not records:
+        parser.error("{} has no frames".format(args.log))
+    span = records[-1][0] - records[0][0] + TEXT_INTERVAL
+    records = [(timestamp + span * lap, raw)
+               for lap in range(args.repeat) for timestamp, raw in records]
+
+    speed = None if args.speed == 'max' else float(args.speed)
+    asyncio.run(async_replay(records, speed, args.burst))
+
+
+if __name__ == '__main__':
+    main()
@@ -4,11 +4,21 @@ Support for DALI lights.
 For more details about this platform, please refer to the documentation at
 https://home-assistant.io/components/light.dali/
 """
+import asyncio
+import collections
+import concurrent.futures
+import functools
+import itertools
 import logging
+import statistics
+import threading
+import time
 
 import voluptuous as vol
 
-from homeassistant.const import (CONF_NAME, CONF_ID, CONF_DEVICES)
+from homeassistant.const import (
+    CONF_NAME, CONF_ID, CONF_DEVICES, EVENT_HOMEASSISTANT_STOP)
+from homeassistant.core import callback
 from homeassistant.components.light import (
     ATTR_BRIGHTNESS, SUPPORT_BRIGHTNESS, Light, PLATFORM_SCHEMA)
 import homeassistant.helpers.config_validation as cv
@@ -20,72 +30,796 @@ _LOGGER = logging.getLogger(__name__)
 SUPPORT_DALI = SUPPORT_BRIGHTNESS
 
 CONF_MAX_GEARS = "max_gears"
+CONF_DISCOVERY = "discovery"
+
+DISCOVERY_SCAN = "scan"
+DISCOVERY_SEARCH = "search"
 
 MAX_RANGE = 64
+MAX_RANDOM_ADDRESS = 0xffffff
+RANDOMISE_DELAY = 0.1
+SEARCH_ROUNDS = 5
+
+INVENTORY_FILE = "dali_inventory.json"
+
+ATTR_DEVICE_TYPE = "device_type"
+ATTR_LEVEL = "level"
+ATTR_GROUPS = "groups"
+ATTR_GEARS = "gears"
+ATTR_QUEUE_DEPTH = "queue_depth"
+ATTR_LATENCY = "latency"
+ATTR_COALESCED_COMMANDS = "coalesced_commands"
+
+PRIORITY_USER = 0
+PRIORITY_QUERY = 1
+PRIORITY_DISCOVERY = 2
+
+QUEUE_SIZE = 32
+SEND_TIMEOUT = 60
+LATENCY_SAMPLES = 100
+
+DALI_GROUPS = 16
+LEARN_AFTER = 2
+MAX_SEEN = 64
+
+_INVENTORY_LOCK = threading.Lock()
 
 PLATFORM_SCHEMA = PLATFORM_SCHEMA.extend({
     vol.Required(CONF_NAME): cv.string,
     vol.Optional(CONF_MAX_GEARS, default=MAX_RANGE): cv.positive_int,
+    vol.Optional(CONF_DISCOVERY, default=DISCOVERY_SCAN):
+        vol.In([DISCOVERY_SCAN, DISCOVERY_SEARCH]),
 })
 
 
-def setup_platform(hass, config, add_devices, discovery_info=None):
+async def async_setup_platform(hass, config, async_add_devices,
+                               discovery_info=None):
     """Set up the DALI Light platform."""
 
-    from dali.driver.hasseb import SyncHassebDALIUSBDriver 
     from dali.address import Short
-    from dali.command import YesNoResponse, Response
+    from dali.driver.hasseb import SyncHassebDALIUSBDriver 
+
+    dali_driver = await hass.async_add_executor_job(SyncHassebDALIUSBDriver)
+    scheduler = BusScheduler(hass, dali_driver)
+    scheduler.async_start()
+    hass.bus.async_listen_once(EVENT_HOMEASSISTANT_STOP, scheduler.async_stop)
+
+    if config[CONF_DISCOVERY] == DISCOVERY_SEARCH:
+        discover = search_gears
+    else:
+        discover = functools.partial(scan_gears, max_gears=config[CONF_MAX_GEARS])
+
+    inventory = GearInventory(
+        hass, hass.config.path(INVENTORY_FILE), config[CONF_NAME])
+    await hass.async_add_executor_job(inventory.load)
+    # Broadcast only when discovery covers every gear that would answer it
+    batcher = LevelBatcher(
+        hass, scheduler, inventory,
+        broadcast=(config[CONF_DISCOVERY] == DISCOVERY_SEARCH or
+                   config[CONF_MAX_GEARS] >= MAX_RANGE))
+
+    def create_light(ballast):
+        """Return the light of ballast."""
+        return DALILight(scheduler, batcher, config[CONF_NAME], ballast,
+                         inventory)
+
+    lights = {address: create_light(Short(address))
+              for address in sorted(inventory.gears)}
+
+    @callback
+    def async_save_inventory(event):
+        """Save the levels the lights were left at."""
+        inventory.async_save()
+
+    hass.bus.async_listen_once(EVENT_HOMEASSISTANT_STOP, async_save_inventory)
+
+    driver = QueuedDriver(scheduler, PRIORITY_DISCOVERY)
+    if lights:
+        # The cached gears are up right away, the bus is checked afterwards
+        async_add_devices(list(lights.values()))
+        hass.async_create_task(async_verify_inventory(
+            hass, driver, discover, inventory, lights, create_light,
+            async_add_devices))
+    else:
+        await async_verify_inventory(hass, driver, discover, inventory, lights,
+                                     create_light, async_add_devices)
+
+
+async def async_verify_inventory(hass, driver, discover, inventory, lights,
+                                 create_light, async_add_devices):
+    """Discover the gears on the bus and apply what differs from lights.
+
+    New gears get a light from create_light, gears that changed level,
+    device type or groups update their light and missing gears become
+    unavailable. Gears that fail to answer are left as they were. The
+    inventory is saved when anything changed. The bus is queried in the
+    executor through driver, a QueuedDriver with discovery priority, the
+    inventory and the lights are only changed here, on the event loop.
+    """
+    found = await hass.async_add_executor_job(query_gears, driver, discover)
+
+    changed = False
+    new_lights = []
+    for ballast, gear in found:
+        if gear is None:
+            continue
+        light = lights.get(ballast.address)
+        if light is None:
+            _LOGGER.info("Found new Gear <{}>".format(ballast.address))
+            inventory.gears[ballast.address] = gear
+            light = lights[ballast.address] = create_light(ballast)
+            new_lights.append(light)
+            changed = True
+        elif gear != inventory.gears.get(ballast.address) or not light.available:
+            inventory.gears[ballast.address] = gear
+            light.async_inventory_changed()
+            changed = True
+
+    addresses = set(ballast.address for ballast, _ in found)
+    for address, light in lights.items():
+        if address not in addresses and light.available:
+            _LOGGER.warning("Gear <{}> is no longer on the bus".format(address))
+            inventory.gears.pop(address, None)
+            light.async_inventory_changed()
+            changed = True
+
+    if new_lights:
+        async_add_devices(new_lights)
+    if changed:
+        await inventory.async_save()
+
+
+def query_gears(driver, discover):
+    """Discover the gears on the bus and query them, in a thread.
+
+    Returns the (ballast, gear) of the gears found, gear is None for those
+    that failed to answer.
+    """
+    found = []
+    for ballast in discover(driver):
+        try:
+            found.append((ballast, query_gear(driver, ballast)))
+        except Exception as e:
+            _LOGGER.error("Error while querying Gear <{}>: {}".format(
+                ballast.address, e))
+            found.append((ballast, None))
+    return found
+
+
+def actual_level(response):
+    """Return the level of a QueryActualLevel response.
+
+    The response value is the level, 'MASK' (255, level unknown),
+    '(missing)' or '(framing error)': returns the level, 255 for MASK and
+    None when no level came.
+    """
+    if response.value == "MASK":
+        return 255
+    if isinstance(response.value, int):
+        return response.value
+    return None
+
+
+def backward_frame(response):
+    """Return the backward frame of a plain Response as an int, or None.
+
+    Raises ResponseError on a framing error (several gears answered).
+    """
+    if response.value is None:
+        return None
+    return response.value.as_integer
+
+
+def query_gear(driver, ballast):
+    """Return the device type, actual level and groups of ballast.
+
+    Queries left unanswered leave their field empty, bus errors are raised.
+    """
+    from dali.gear.general import (
+        QueryActualLevel, QueryDeviceType, QueryGroupsZeroToSeven,
+        QueryGroupsEightToFifteen)
+    from dali.command import ResponseError, MissingResponse
+
+    gear = {ATTR_DEVICE_TYPE: None, ATTR_LEVEL: None, ATTR_GROUPS: []}
+    try:
+        gear[ATTR_DEVICE_TYPE] = backward_frame(
+            driver.send(QueryDeviceType(ballast)))
+        level = actual_level(driver.send(QueryActualLevel(ballast)))
+        if level is not None and level < 255:
+            gear[ATTR_LEVEL] = level
+        groups = 0
+        for shift, query in ((0, QueryGroupsZeroToSeven),
+                             (8, QueryGroupsEightToFifteen)):
+            frame = backward_frame(driver.send(query(ballast)))
+            if frame is not None:
+                groups |= frame << shift
+        gear[ATTR_GROUPS] = [group for group in range(DALI_GROUPS)
+                             if groups >> group & 1]
+    except ResponseError as e:
+        _LOGGER.error("Response error querying Gear <{}>".format(ballast.address))
+    except MissingResponse as e:
+        _LOGGER.debug("Gear <{}> didn't answer".format(ballast.address))
+    return gear
+
+
+class BusScheduler(object):
+    """Send the commands of one DALI interface, most urgent first.
+
+    The driver blocks and the bus carries one frame at a time, so a single
+    task takes the commands from a bounded priority queue and sends them
+    one by one in an executor: user commands go before state queries, which
+    go before discovery. Queries and discovery wait while QUEUE_SIZE of them
+    are queued, user commands are never held back. The time from queueing
+    to answer of the last LATENCY_SAMPLES frames of each priority is kept.
+    Once stopped, the commands still queued or sent afterwards fail with
+    HomeAssistantError.
+    """
+
+    def __init__(self, hass, driver):
+        """Initialize the scheduler."""
+        self._hass = hass
+        self._driver = driver
+        self._queue = asyncio.PriorityQueue()
+        self._slots = asyncio.Semaphore(QUEUE_SIZE)
+        self._sequence = itertools.count()
+        self._task = None
+        self._sending = None
+        self._stopped = False
+        self.frames = 0
+        self.latencies = {
+            priority: collections.deque(maxlen=LATENCY_SAMPLES)
+            for priority in (PRIORITY_USER, PRIORITY_QUERY, PRIORITY_DISCOVERY)}
+
+    @property
+    def queue_depth(self):
+        """Return the number of commands waiting."""
+        return self._queue.qsize()
+
+    def latency(self, priority):
+        """Return the median latency in ms of the recent frames of priority."""
+        latencies = self.latencies[priority]
+        if not latencies:
+            return None
+        return round(1000 * statistics.median(latencies), 1)
+
+    @callback
+    def async_start(self):
+        """Start sending the queued commands."""
+        self._task = self._hass.async_create_task(self._async_run())
+
+    @callback
+    def async_stop(self, event=None):
+        """Stop sending, fail the command being sent and those queued."""
+        from homeassistant.exceptions import HomeAssistantError
+
+        self._stopped = True
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        futures = [self._sending] if self._sending is not None else []
+        self._sending = None
+        while not self._queue.empty():
+            priority, _, _, _, future = self._queue.get_nowait()
+            if priority != PRIORITY_USER:
+                self._slots.release()
+            futures.append(future)
+        for future in futures:
+            if not future.done():
+                future.set_exception(
+                    HomeAssistantError("DALI bus scheduler stopped"))
+
+    async def async_send(self, command, priority=PRIORITY_USER):
+        """Queue command, returns its response once sent."""
+        from homeassistant.exceptions import HomeAssistantError
+
+        future = self._hass.loop.create_future()
+        if priority != PRIORITY_USER:
+            await self._slots.acquire()
+        if self._stopped:
+            if priority != PRIORITY_USER:
+                self._slots.release()
+            raise HomeAssistantError("DALI bus scheduler stopped")
+        self._queue.put_nowait(
+            (priority, next(self._sequence), time.monotonic(), command, future))
+        return await future
+
+    def send(self, command, priority=PRIORITY_QUERY):
+        """Queue command from another thread, returns its response once sent.
+
+        Must not be called from the event loop, it blocks until the command
+        has been sent. Raises HomeAssistantError if it is not sent within
+        SEND_TIMEOUT seconds, the command is then dropped.
+        """
+        from homeassistant.exceptions import HomeAssistantError
+
+        future = asyncio.run_coroutine_threadsafe(
+            self.async_send(command, priority), self._hass.loop)
+        try:
+            return future.result(SEND_TIMEOUT)
+        except concurrent.futures.TimeoutError:
+            future.cancel()
+            raise HomeAssistantError(
+                "{} not sent within {}s".format(command, SEND_TIMEOUT))
+
+    async def _async_run(self):
+        """Send the queued commands, one at a time."""
+        while True:
+            priority, _, queued, command, future = await self._queue.get()
+            if priority != PRIORITY_USER:
+                self._slots.release()
+            if future.done():
+                continue
+            self._sending = future
+            try:
+                response = await self._hass.async_add_executor_job(
+                    self._driver.send, command)
+            except Exception as e:
+                if not future.done():
+                    future.set_exception(e)
+            else:
+                if not future.done():
+                    future.set_result(response)
+            finally:
+                self._sending = None
+            self.frames += 1
+            self.latencies[priority].append(time.monotonic() - queued)
+
+
+class QueuedDriver(object):
+    """A blocking driver that sends through a BusScheduler at priority.
+
+    Lets scan_gears, search_gears and query_gear run in a thread while
+    user commands keep going first.
+    """
+
+    def __init__(self, scheduler, priority):
+        """Initialize the driver."""
+        self.scheduler = scheduler
+        self.priority = priority
+
+    def send(self, command):
+        """Send command, returns its response."""
+        return self.scheduler.send(command, self.priority)
+
+
+class GearInventory(object):
+    """The gears of a DALI controller, kept in a JSON file across restarts.
+
+    Maps short addresses to the device type, last known level and groups
+    of each gear, so the lights can be added before the bus is scanned, and
+    keeps when each group set up by LevelBatcher was last used. The file
+    holds the inventories of all controllers, by name.
+
+    gears and groups belong to the event loop: saving copies them there and
+    writes the copy in the executor.
+    """
+
+    def __init__(self, hass, path, name):
+        """Initialize the inventory."""
+        self._hass = hass
+        self.path = path
+        self.name = name
+        self.gears = {}
+        self.groups = {}
+
+    def load(self):
+        """Load the gears saved by the previous run, returns them."""
+        from homeassistant.exceptions import HomeAssistantError
+        from homeassistant.util.json import load_json
+
+        with _INVENTORY_LOCK:
+            try:
+                data = load_json(self.path)
+            except HomeAssistantError as e:
+                _LOGGER.error("Can't load {}: {}".format(self.path, e))
+                data = {}
+        data = data.get(self.name, {})
+        self.gears = {int(address): gear
+                      for address, gear in data.get(ATTR_GEARS, {}).items()}
+        self.groups = {int(group): used
+                       for group, used in data.get(ATTR_GROUPS, {}).items()}
+        return self.gears
+
+    def snapshot(self):
+        """Return a copy of the inventory as saved, from the event loop."""
+        return {
+            ATTR_GEARS: {str(address): dict(gear)
+                         for address, gear in sorted(self.gears.items())},
+            ATTR_GROUPS: {str(group): used
+                          for group, used in sorted(self.groups.items())},
+        }
+
+    def write(self, snapshot):
+        """Write snapshot to the file, blocks."""
+        from homeassistant.exceptions import HomeAssistantError
+        from homeassistant.util.json import load_json, save_json
+
+        with _INVENTORY_LOCK:
+            try:
+                data = load_json(self.path)
+            except HomeAssistantError:
+                data = {}
+            data[self.name] = snapshot
+            try:
+                save_json(self.path, data)
+            except HomeAssistantError as e:
+                _LOGGER.error("Can't save {}: {}".format(self.path, e))
+
+    @callback
+    def async_save(self):
+        """Save the inventory in the executor, returns the job."""
+        return self._hass.async_add_executor_job(self.write, self.snapshot())
+
+    def set_level(self, address, level):
+        """Keep the last level sent to a gear."""
+        gear = self.gears.get(address)
+        if gear is not None:
+            gear[ATTR_LEVEL] = level
+
+    def members(self, group):
+        """Return the addresses of the gears in group."""
+        return frozenset(address for address, gear in self.gears.items()
+                         if group in gear.get(ATTR_GROUPS, ()))
+
+    def set_group(self, address, group, member):
+        """Keep that a gear was added to (member) or removed from group."""
+        gear = self.gears.get(address)
+        if gear is None:
+            return
+        groups = set(gear.get(ATTR_GROUPS, ()))
+        if member:
+            groups.add(group)
+        else:
+            groups.discard(group)
+        gear[ATTR_GROUPS] = sorted(groups)
+
+
+class LevelBatcher(object):
+    """Send the levels set in the same loop iteration with as few frames.
+
+    Lights set to the same level together (a light group, an area, a scene)
+    are switched at once by one frame: a broadcast when they are all the
+    gears of the bus, or to a DALI group of exactly those gears. A set of
+    lights seen LEARN_AFTER times without such a group gets one in the
+    background, with AddToGroup/RemoveFromGroup: a group no gear is in, or
+    else the least recently used group set up here. Groups set up by other
+    means are used but never changed.
+
+    Each gear has at most one command queued: a level set while the last
+    one is still waiting for the bus (a brightness slider) replaces the
+    level waiting after it, the latest value wins.
+    """
+
+    def __init__(self, hass, scheduler, inventory, broadcast=True):
+        """Initialize the batcher."""
+        self._hass = hass
+        self._scheduler = scheduler
+        self._inventory = inventory
+        self._broadcast = broadcast
+        self._pending = {}
+        self._sending = set()
+        self._flush = None
+        self._seen = collections.Counter()
+        self._programming = {}
+        self.collapsed_commands = 0
+        self.coalesced_commands = collections.Counter()
+
+    async def async_set_level(self, address, level):
+        """Set the level of a gear, None to turn it off, once sent.
+
+        Returns once the level, or a level set after it, has been sent.
+        """
+        future = self._hass.loop.create_future()
+        futures = [future]
+        if address in self._pending:
+            self.coalesced_commands[address] += 1
+            futures = self._pending[address][1] + futures
+        self._pending[address] = (level, futures)
+        if address not in self._sending and self._flush is None:
+            self._flush = self._hass.loop.call_soon(self._async_flush)
+        return await future
+
+    @callback
+    def _async_flush(self):
+        """Send the pending levels, one frame per level when possible."""
+        self._flush = None
+        levels = collections.defaultdict(dict)
+        for address in list(self._pending):
+            if address not in self._sending:
+                level, futures = self._pending.pop(address)
+                levels[level][address] = futures
+        for level, futures in levels.items():
+            for destination, addresses in self._destinations(
+                    frozenset(futures)):
+                self.collapsed_commands += len(addresses) - 1
+                self._sending.update(addresses)
+                self._hass.async_create_task(self._async_send(
+                    destination, level, addresses, [
+                        future for address in addresses
+                        for future in futures[address]]))
+
+    def _destinations(self, addresses):
+        """Return the (destination, addresses) reaching all of addresses."""
+        from dali.address import Broadcast, Group, Short
+
+        if len(addresses) > 1:
+            if self._broadcast and addresses == frozenset(
+                    self._inventory.gears):
+                return [(Broadcast(), addresses)]
+            for group in range(DALI_GROUPS):
+                if self._inventory.members(group) == addresses:
+                    if group in self._inventory.groups:
+                        self._inventory.groups[group] = time.time()
+                    return [(Group(group), addresses)]
+            self._seen[addresses] += 1
+            if self._seen[addresses] >= LEARN_AFTER:
+                self._async_learn(addresses)
+            elif len(self._seen) > MAX_SEEN:
+                self._seen.clear()
+        return [(Short(address), [address]) for address in sorted(addresses)]
+
+    async def _async_send(self, destination, level, addresses, futures):
+        """Send level to destination, answer the futures of its lights.
+
+        Then sends the levels set for addresses while it was waiting.
+        """
+        from dali.gear.general import DAPC, Off
+
+        command = Off(destination) if level is None else DAPC(destination, level)
+        try:
+            response = await self._scheduler.async_send(command, PRIORITY_USER)
+        except Exception as e:
+            for future in futures:
+                if not future.done():
+                    future.set_exception(e)
+        else:
+            for future in futures:
+                if not future.done():
+                    future.set_result(response)
+        finally:
+            self._sending.difference_update(addresses)
+            if self._flush is None and any(
+                    address in self._pending for address in addresses):
+                self._flush = self._hass.loop.call_soon(self._async_flush)
+
+    @callback
+    def _async_learn(self, addresses):
+        """Set up a group of addresses in the background, if there's one."""
+        if addresses in self._programming:
+            return
+        groups = [group for group in range(DALI_GROUPS)
+                  if group not in self._inventory.groups and
+                  not self._inventory.members(group)]
+        if not groups:
+            groups = sorted(
+                (group for group in self._inventory.groups
+                 if group not in self._programming.values()),
+                key=self._inventory.groups.get)
+        if not groups:
+            return
+        self._programming[addresses] = groups[0]
+        self._seen.pop(addresses, None)
+        self._inventory.groups[groups[0]] = time.time()
+        self._hass.async_create_task(
+            self._async_program(groups[0], addresses))
+
+    async def _async_program(self, group, addresses):
+        """Make addresses the members of group, then save the inventory."""
+        from dali.address import Short
+        from dali.gear.general import AddToGroup, RemoveFromGroup
+
+        members = self._inventory.members(group)
+        _LOGGER.debug("Setting up group {} with {}".format(
+            group, sorted(addresses)))
+        try:
+            for address in sorted(members - addresses):
+                await self._scheduler.async_send(
+                    RemoveFromGroup(Short(address), group), PRIORITY_DISCOVERY)
+                self._inventory.set_group(address, group, False)
+            for address in sorted(addresses - members):
+                await self._scheduler.async_send(
+                    AddToGroup(Short(address), group), PRIORITY_DISCOVERY)
+                self._inventory.set_group(address, group, True)
+        except Exception as e:
+            _LOGGER.error("Error while setting up group {}: {}".format(group, e))
+        finally:
+            del self._programming[addresses]
+        await self._inventory.async_save()
+
+
+def gears_present(driver):
+    """Return True if any gear answers QueryControlGearPresent on broadcast."""
+    from dali.address import Broadcast
     import dali.gear.general as gear
 
-    dali_driver = SyncHassebDALIUSBDriver() 
-    import threading
-    lock = threading.RLock()
+    try:
+        return driver.send(gear.QueryControlGearPresent(Broadcast())).value
+    except Exception as e:
+        _LOGGER.error("Error while QueryControlGearPresent: {}".format(e))
+        return True
+
+
+def scan_gears(driver, max_gears):
+    """Return the Short addresses below max_gears that answer."""
+    from dali.address import Short
+    from dali.command import YesNoResponse
+    import dali.gear.general as gear
 
     lamps = []
-    for lamp in range(0,config[CONF_MAX_GEARS]):
+    if not gears_present(driver):
+        _LOGGER.warning("No DALI gear present")
+        return lamps
+
+    for lamp in range(0, max_gears):
         try:
             _LOGGER.debug("Searching for Gear on address <{}>".format(lamp))
-            r = dali_driver.send(gear.QueryControlGearPresent(Short(lamp)))
+            r = driver.send(gear.QueryControlGearPresent(Short(lamp)))
             if isinstance(r, YesNoResponse) and r.value:
                 lamps.append(Short(lamp))
         except Exception as e:
-            #Not present
-            _LOGGER.error("Error while QueryControlGearPresent: {}".format(e))
-            break
+            _LOGGER.error("Error while QueryControlGearPresent <{}>: {}".format(
+                lamp, e))
+    return lamps
+
+
+def search_gears(driver):
+    """Return the Short addresses of the gears, found by their random address.
+
+    Every gear picks a random 24-bit address (Randomise), the lowest one is
+    found by binary search with Compare, asked for its short address and
+    withdrawn from the search, until no gear is left. Gears that picked the
+    same random address answer at once (a framing error), the gears left
+    then pick new ones, up to SEARCH_ROUNDS times. Gears without a short
+    address are searched again on their own afterwards and each is given
+    the lowest free one (ProgramShortAddress).
+    """
+    from dali.address import Short
+    import dali.gear.general as gear
+
+    if not gears_present(driver):
+        _LOGGER.warning("No DALI gear present")
+        return []
+
+    lamps = {}
+    search_address = [None, None, None]
+
+    def set_search_address(address):
+        """Send the bytes of address that changed since the last one."""
+        for index, command in enumerate(
+                (gear.SetSearchAddrH, gear.SetSearchAddrM, gear.SetSearchAddrL)):
+            byte = (address >> (16 - 8 * index)) & 0xff
+            if search_address[index] != byte:
+                driver.send(command(byte))
+                search_address[index] = byte
+
+    def compare(address):
+        """Return True if a gear has a random address <= address."""
+        set_search_address(address)
+        return driver.send(gear.Compare()).value
+
+    def lowest(low):
+        """Return the lowest random address >= low left, None if none is."""
+        high = MAX_RANDOM_ADDRESS
+        answered = False
+        while low < high:
+            middle = (low + high) // 2
+            if compare(middle):
+                high = middle
+                answered = True
+            else:
+                low = middle + 1
+        if answered or compare(low):
+            return low
+        return None
+
+    def program(random_address):
+        """Give the gear selected the lowest free short address."""
+        free = [address for address in range(MAX_RANGE)
+                if address not in lamps]
+        if not free:
+            _LOGGER.error("No free short address for the gear at random "
+                          "address {:06x}".format(random_address))
+            return
+        driver.send(gear.ProgramShortAddress(free[0]))
+        if driver.send(gear.VerifyShortAddress(free[0])).value:
+            _LOGGER.info("Gave short address {} to the gear at random "
+                         "address {:06x}".format(free[0], random_address))
+            lamps[free[0]] = Short(free[0])
+        else:
+            _LOGGER.warning("Gear at random address {:06x} did not take short "
+                            "address {}".format(random_address, free[0]))
+
+    def search(programming):
+        """Find the gears initialised, returns the number without address.
+
+        Returns None if gears kept picking the same random address.
+        """
+        unaddressed = 0
+        for _ in range(SEARCH_ROUNDS):
+            driver.send(gear.Randomise())
+            time.sleep(RANDOMISE_DELAY)
+            low = lowest(0)
+            while low is not None:
+                set_search_address(low)
+                r = driver.send(gear.QueryShortAddress())
+                if r.value == "(framing error)":
+                    _LOGGER.debug("Gears share random address {:06x}".format(
+                        low))
+                    break
+                if isinstance(r.value, int):
+                    _LOGGER.debug("Found Gear <{}> at random address "
+                                  "{:06x}".format(r.value >> 1, low))
+                    lamps[r.value >> 1] = Short(r.value >> 1)
+                elif r.value == "MASK" and programming:
+                    program(low)
+                elif r.value == "MASK":
+                    unaddressed += 1
+                else:
+                    _LOGGER.warning("Gear at random address {:06x} answered "
+                                    "{}".format(low, r.value))
+                driver.send(gear.Withdraw())
+                if low == MAX_RANDOM_ADDRESS:
+                    return unaddressed
+                low = lowest(low)
+            else:
+                return unaddressed
+        _LOGGER.error("DALI gears still share random addresses after {} "
+                      "rounds".format(SEARCH_ROUNDS))
+        return None
+
+    try:
+        driver.send(gear.Terminate())
+        driver.send(gear.Initialise(broadcast=True))
+        unaddressed = search(False)
+        if unaddressed:
+            driver.send(gear.Terminate())
+            driver.send(gear.Initialise())
+            search(True)
+        elif unaddressed is None:
+            _LOGGER.warning("Not all DALI gears were found, no short "
+                            "address is given out")
+    except Exception as e:
+        _LOGGER.error("Error while searching DALI gears: {}".format(e))
+    finally:
+        try:
+            driver.send(gear.Terminate())
+        except Exception as e:
+            _LOGGER.error("Error while Terminate: {}".format(e))
+
+    return [lamps[address] for address in sorted(lamps)]
 
-    add_devices([DALILight(dali_driver, lock, config[CONF_NAME], l) for l in lamps])
-    
 
 class DALILight(Light):
     """Representation of an DALI Light."""
 
-    def __init__(self, driver, driver_lock, controller_name, ballast):
-        from dali.gear.general import QueryActualLevel
-        from dali.command import ResponseError, MissingResponse
-        """Initialize a DALI Light."""
-        self._brightness = 0
-        self._state = False       
+    def __init__(self, scheduler, batcher, controller_name, ballast, inventory):
+        """Initialize a DALI Light from its inventory entry."""
         self._name = "{}_{}".format(controller_name, ballast.address)
         self.attributes = {"short_address": ballast.address}
         
-        self.driver = driver
-        self.driver_lock = driver_lock
+        self.scheduler = scheduler
+        self.batcher = batcher
         self.addr = ballast
+        self.inventory = inventory
+        self._load_inventory()
 
-        try:
-            with self.driver_lock:
-                cmd = QueryActualLevel(self.addr)
-                r = self.driver.send(cmd)
-                if r.value != None and r.value.as_integer < 255:
-                    self._brightness = r.value.as_integer
-                    if r.value.as_integer > 0:
-                        r.state = True
+    def _load_inventory(self):
+        """Take the state from the inventory, unavailable if not there."""
+        gear = self.inventory.gears.get(self.addr.address)
+        self._available = gear is not None
+        if gear is None:
+            return
+        self.attributes[ATTR_DEVICE_TYPE] = gear[ATTR_DEVICE_TYPE]
+        self.attributes[ATTR_GROUPS] = gear.get(ATTR_GROUPS, [])
+        self._brightness = gear[ATTR_LEVEL]
+        self._state = None if gear[ATTR_LEVEL] is None else gear[ATTR_LEVEL] > 0
 
-        except ResponseError as e:
-            _LOGGER.error("Response error on __init__")
-        except MissingResponse as e:
-            self._brightness = None
-            self._state = None
+    @callback
+    def async_inventory_changed(self):
+        """Update the state after the inventory entry changed."""
+        self._load_inventory()
+        if self.hass is not None:
+            self.async_schedule_update_ha_state()
 
     @property
     def name(self):
@@ -97,6 +831,11 @@ class DALILight(Light):
         """Return the Short Address of this light."""
         return self.addr.address
 
+    @property
+    def available(self):
+        """Return True if the gear was found on the bus."""
+        return self._available
+
     @property
     def brightness(self):
         """Return the brightness of the light."""
@@ -105,7 +844,12 @@ class DALILight(Light):
     @property
     def device_state_attributes(self):
         """Show Device Attributes."""
-        return self.attributes
+        return dict(self.attributes, **{
+            ATTR_QUEUE_DEPTH: self.scheduler.queue_depth,
+            ATTR_LATENCY: self.scheduler.latency(PRIORITY_USER),
+            ATTR_COALESCED_COMMANDS:
+                self.batcher.coalesced_commands[self.addr.address],
+        })
 
     @property
     def is_on(self):
@@ -117,63 +861,66 @@ class DALILight(Light):
         """Flag supported features."""
         return SUPPORT_DALI
 
-    def turn_on(self, **kwargs):
+    async def async_turn_on(self, **kwargs):
         """Instruct the light to turn on."""
-        from dali.gear.general import DAPC
+        import usb
  
-        with self.driver_lock:
-            try:
-                self._brightness = kwargs.get(ATTR_BRIGHTNESS, 254)
-                _LOGGER.debug("turn on {}".format(self._brightness))
-                cmd = DAPC(self.addr, 254 if self._brightness==255 else self._brightness)
-                r = self.driver.send(cmd)
-                if self._brightness > 0:
-                    self._state = True
-            except usb.core.USBError as e:
-                _LOGGER.error("Can't turn_on {}: {}".format(self._name, e))
-        self.schedule_update_ha_state()
+        try:
+            self._brightness = kwargs.get(ATTR_BRIGHTNESS, 254)
+            _LOGGER.debug("turn on {}".format(self._brightness))
+            level = 254 if self._brightness==255 else self._brightness
+            r = await self.batcher.async_set_level(self.addr.address, level)
+            self.inventory.set_level(self.addr.address, level)
+            if self._brightness > 0:
+                self._state = True
+        except usb.core.USBError as e:
+            _LOGGER.error("Can't turn_on {}: {}".format(self._name, e))
+        self.async_schedule_update_ha_state()
 
-    def turn_off(self, **kwargs):
+    async def async_turn_off(self, **kwargs):
         """Instruct the light to turn off."""
-        from dali.gear.general import Off 
+        import usb
 
-        with self.driver_lock:
-            try:
-                cmd = Off(self.addr)
-                r = self.driver.send(cmd)
-                self._state = False 
-            except usb.core.USBError as e:
-                _LOGGER.error("Can't turn_on {}: {}".format(self._name, e))
-        self.schedule_update_ha_state()
+        try:
+            r = await self.batcher.async_set_level(self.addr.address, None)
+            self.inventory.set_level(self.addr.address, 0)
+            self._state = False 
+        except usb.core.USBError as e:
+            _LOGGER.error("Can't turn_on {}: {}".format(self._name, e))
+        self.async_schedule_update_ha_state()
 
     @property
     def should_poll(self):
         """Doesn't make much sense to poll, commands have acks"""
         return False 
 
-    def update(self):
+    async def async_update(self):
         """Fetch update state."""
         from dali.gear.general import QueryActualLevel
         from dali.command import ResponseError, MissingResponse
         import usb
 
-        with self.driver_lock:
-            try:
-                r = self.driver.send(QueryActualLevel(self.addr))
-                _LOGGER.debug(r)
-                if r:
-                    self._brightness = r.value.as_integer
-                    if 0 < self._brightness < 255:
-                        self._state = True
-                    else:
-                        self._state = False
-                else:
-                    _LOGGER.error("return value = {}", r)
-            except usb.core.USBError as e:
-                _LOGGER.error("Can't update {}: {}".format(self._name, e))
-            except ResponseError as e:
+        try:
+            r = await self.scheduler.async_send(
+                QueryActualLevel(self.addr), PRIORITY_QUERY)
+            _LOGGER.debug(r)
+            level = actual_level(r)
+            if r.value == "(framing error)":
                 _LOGGER.error("ResponseError QueryActualLevel")
-            except MissingResponse as e:
+            elif level is None:
                 self._brightness = None
-        
- 
+            else:
+                self._brightness = level
+                if 0 < self._brightness < 255:
+                    self._state = True
+                else:
+                    self._state = False
+                self.inventory.set_level(
+                    self.addr.address,
+                    self._brightness if self._brightness < 255 else None)
+        except usb.core.USBError as e:
+            _LOGGER.error("Can't update {}: {}".format(self._name, e))
+        except ResponseError as e:
+            _LOGGER.error("ResponseError QueryActualLevel")
+        except MissingResponse as e:
+            self._brightness = None
@@ -1,67 +1,687 @@
-"""Filter helpers for Home Assistant."""
+"""Filter helpers for Home Assistant.
+
+The filters follow the semantics of Home Assistant's filter sensor, but have
+no dependency on Home Assistant. numpy is optional and only imported on the
+first burst of samples.
+"""
 import logging
-import inspect
+import struct
+from array import array
+from bisect import bisect_left, insort
+from collections import OrderedDict
+from datetime import timedelta
+from time import monotonic
 
-from homeassistant.components.filter.sensor import (
-    OutlierFilter, LowPassFilter, ThrottleFilter,
-    TimeSMAFilter, FilterState)
-import homeassistant.util.dt as dt_util 
+_LOGGER = logging.getLogger(__name__)
 
+np = None
+NUMPY_LOADED = False
 
 FILTER_LOWPASS = 'lowpass'
 FILTER_OUTLIER = 'outlier'
 FILTER_TIME_SMA = 'time_sma'
 FILTER_THROTTLE = 'throttle'
 
+MAX_ENTITIES = 256
+VECTOR_MIN_SAMPLES = 8
+TIME_SMA_MAX_SAMPLES = 128
+
+SNAPSHOT_VERSION = 1
+SNAPSHOT_HEADER = struct.Struct('<B')
+SNAPSHOT_ENTRY = struct.Struct('<HI')
+
+def load_numpy():
+    """Import numpy on first use, returns None if it is not installed."""
+    global np, NUMPY_LOADED
+    if not NUMPY_LOADED:
+        try:
+            import numpy as np
+        except ImportError:
+            _LOGGER.debug("numpy not available, bursts are filtered one by one")
+        NUMPY_LOADED = True
+    return np
+
+class FilterBank(object):
+    """Filter state of all the channels sharing one filter configuration.
+
+    Each channel is a row in flat arrays, so a burst of samples for many
+    channels can be filtered in one vectorized step with numpy
+    (update_many). Single samples, or all samples when numpy is not
+    available, go through the scalar code path which gives the same results.
+    """
+
+    def __init__(self, window_size=1, precision=None, entity=None):
+        """Initialize an empty bank."""
+        self.window_size = window_size
+        self.precision = precision
+        self.entity = entity
+        self.size = 0
+        self.free = []
+        self.fields = []
+
+    def add_field(self, name, typecode, width):
+        """Add an array holding width items of each row."""
+        setattr(self, name, array(typecode))
+        self.fields.append((name, array(typecode, [0]) * width))
+
+    def allocate(self):
+        """Return a new (zeroed) row."""
+        if self.free:
+            row = self.free.pop()
+            for name, blank in self.fields:
+                width = len(blank)
+                getattr(self, name)[row * width:(row + 1) * width] = blank
+            return row
+
+        row = self.size
+        self.size += 1
+        for name, blank in self.fields:
+            getattr(self, name).extend(blank)
+        return row
+
+    def release(self, row):
+        """Return a row to the bank."""
+        self.free.append(row)
+
+    def pack_row(self, row, now):
+        """Return the state of a row as bytes."""
+        return b''.join(
+            getattr(self, name)[row * len(blank):(row + 1) * len(blank)]
+            .tobytes() for name, blank in self.fields)
+
+    def unpack_row(self, row, data, now):
+        """Load the state of a row from pack_row() bytes."""
+        if len(data) != sum(blank.itemsize * len(blank)
+                            for _, blank in self.fields):
+            raise ValueError("Snapshot does not match the filter settings")
+        offset = 0
+        for name, blank in self.fields:
+            size = blank.itemsize * len(blank)
+            values = array(blank.typecode)
+            values.frombytes(data[offset:offset + size])
+            getattr(self, name)[row * len(blank):(row + 1) * len(blank)] = \
+                values
+            offset += size
+
+    def view(self, name):
+        """Return a numpy view of a field, one line per row."""
+        blank = dict(self.fields)[name]
+        return np.frombuffer(getattr(self, name),
+                             dtype=np.int64 if blank.typecode == 'q'
+                             else np.float64).reshape(self.size, len(blank))
+
+    def round(self, value):
+        """Round a filtered value to the configured precision.
+
+        Uses round() like the filter sensor, on the binary value, so 1.115
+        rounds to 1.11.
+        """
+        if self.precision is None:
+            return value
+        return round(value, self.precision)
+
+    def round_many(self, values):
+        """Round filtered values to the configured precision, as round."""
+        if self.precision is None:
+            return values
+        return np.fromiter((round(value, self.precision)
+                            for value in values.tolist()),
+                           dtype=np.float64, count=len(values))
+
+    def update(self, row, value, timestamp):
+        """Filter a new sample of a channel, returns the filtered value."""
+        raise NotImplementedError
+
+    def update_vector(self, rows, values, timestamps):
+        """Filter new samples of distinct channels in numpy arrays."""
+        raise NotImplementedError
+
+    def update_many(self, rows, values, timestamps):
+        """Filter a burst of samples, returns the filtered values.
+
+        Samples of the same channel are applied in the order given. numpy
+        only pays off across channels: bursts of fewer than
+        VECTOR_MIN_SAMPLES channels are filtered one sample at a time.
+        """
+        if (len(rows) < VECTOR_MIN_SAMPLES or
+                len(set(rows)) < VECTOR_MIN_SAMPLES or load_numpy() is None):
+            return [self.update(row, value, timestamp) for row, value, timestamp
+                    in zip(rows, values, timestamps)]
+
+        rows = np.asarray(rows, dtype=np.int64)
+        values = np.asarray(values, dtype=np.float64)
+        timestamps = np.asarray(timestamps, dtype=np.float64)
+        filtered = np.empty(len(rows))
+        pending = np.arange(len(rows))
+        while pending.size:
+            # first pending sample of each channel, other samples of the same
+            # channel wait for the next pass
+            _, first = np.unique(rows[pending], return_index=True)
+            batch = pending[np.sort(first)]
+            filtered[batch] = self.update_vector(
+                rows[batch], values[batch], timestamps[batch])
+            pending = np.setdiff1d(pending, batch, assume_unique=True)
+        return filtered.tolist()
+
+
+class LowPassBank(FilterBank):
+    """Exponential low-pass filter, same semantics as the lowpass filter."""
+
+    def __init__(self, window_size=1, precision=None, entity=None,
+                 time_constant=10):
+        """Initialize the bank."""
+        super().__init__(window_size, precision, entity)
+        self.new_weight = 1.0 / time_constant
+        self.prev_weight = 1.0 - self.new_weight
+        self.add_field('last', 'd', 1)
+        self.add_field('count', 'q', 1)
+
+    def update(self, row, value, timestamp):
+        """Filter a new sample of a channel."""
+        if self.count[row]:
+            value = (self.prev_weight * self.last[row] +
+                     self.new_weight * value)
+        value = self.round(value)
+        self.last[row] = value
+        self.count[row] = 1
+        return value
+
+    def update_vector(self, rows, values, timestamps):
+        """Filter new samples of distinct channels."""
+        last = self.view('last')[:, 0]
+        count = self.view('count')[:, 0]
+        values = np.where(
+            count[rows] > 0,
+            self.prev_weight * last[rows] + self.new_weight * values, values)
+        values = self.round_many(values)
+        last[rows] = values
+        count[rows] = 1
+        return values
+
+
+class OutlierBank(FilterBank):
+    """Outlier filter, same semantics as the outlier filter.
+
+    Once the window is full, a sample farther than radius from the median of
+    the previous (raw) samples is replaced by that median. Besides the ring
+    buffer, every row keeps its window sorted, so the median is read in O(1)
+    and each sample costs a bisection (O(log w)) plus a memmove instead of a
+    sort of the whole window.
+    """
+
+    def __init__(self, window_size=1, precision=None, entity=None,
+                 radius=2.0):
+        """Initialize the bank."""
+        super().__init__(window_size, precision, entity)
+        self.radius = radius
+        self.ordered = []
+        self.add_field('window', 'd', window_size)
+        self.add_field('head', 'q', 1)
+        self.add_field('count', 'q', 1)
+
+    def allocate(self):
+        """Return a new (empty) row."""
+        row = super().allocate()
+        if row == len(self.ordered):
+            self.ordered.append(array('d'))
+        else:
+            del self.ordered[row][:]
+        return row
+
+    def unpack_row(self, row, data, now):
+        """Load the state of a row, rebuilding its sorted window."""
+        super().unpack_row(row, data, now)
+        start = row * self.window_size
+        self.ordered[row] = array('d', sorted(
+            self.window[start:start + self.count[row]]))
+
+    def median(self, row):
+        """Return the median of the window of a row."""
+        ordered = self.ordered[row]
+        half = len(ordered) // 2
+        if len(ordered) % 2:
+            return ordered[half]
+        return (ordered[half - 1] + ordered[half]) / 2
+
+    def push(self, row, value):
+        """Add a raw sample to the window of a row."""
+        size = self.window_size
+        index = row * size + self.head[row]
+        ordered = self.ordered[row]
+        if self.count[row] == size:
+            del ordered[bisect_left(ordered, self.window[index])]
+        else:
+            self.count[row] += 1
+        insort(ordered, value)
+        self.window[index] = value
+        self.head[row] = (self.head[row] + 1) % size
+
+    def update(self, row, value, timestamp):
+        """Filter a new sample of a channel."""
+        filtered = value
+        if self.count[row] == self.window_size:
+            median = self.median(row)
+            if abs(value - median) > self.radius:
+                filtered = median
+        self.push(row, value)
+        return self.round(filtered)
+
+    def update_vector(self, rows, values, timestamps):
+        """Filter new samples of distinct channels."""
+        count = self.view('count')[:, 0]
+        filtered = values.copy()
+        full = count[rows] == self.window_size
+        if full.any():
+            median = np.array([self.median(row) for row in rows[full].tolist()])
+            outlier = np.abs(values[full] - median) > self.radius
+            filtered[full] = np.where(outlier, median, values[full])
+
+        for row, value in zip(rows.tolist(), values.tolist()):
+            self.push(row, value)
+        return self.round_many(filtered)
+
+
+class TimeSMABank(FilterBank):
+    """Time weighted simple moving average, same semantics as time_sma.
+
+    window_size is a timedelta (or seconds), each channel keeps at most
+    max_samples samples inside the window.
+    """
+
+    def __init__(self, window_size=1, precision=None, entity=None,
+                 type='last', max_samples=TIME_SMA_MAX_SAMPLES):
+        """Initialize the bank."""
+        if isinstance(window_size, timedelta):
+            window_size = window_size.total_seconds()
+        super().__init__(window_size, precision, entity)
+        self.max_samples = max_samples
+        self.add_field('times', 'd', max_samples)
+        self.add_field('values', 'd', max_samples)
+        self.add_field('head', 'q', 1)
+        self.add_field('count', 'q', 1)
+        self.add_field('leak', 'd', 1)
+        self.add_field('leaked', 'q', 1)
+
+    def pack_row(self, row, now):
+        """Return the state of a row, with times relative to now."""
+        start = row * self.max_samples
+        times = array('d', [timestamp - now for timestamp
+                            in self.times[start:start + self.max_samples]])
+        # times is the first field
+        return (times.tobytes() +
+                super().pack_row(row, now)[len(times) * times.itemsize:])
+
+    def unpack_row(self, row, data, now):
+        """Load the state of a row, with times relative to now."""
+        super().unpack_row(row, data, now)
+        start = row * self.max_samples
+        for index in range(start, start + self.max_samples):
+            self.times[index] += now
+
+    def drop_oldest(self, row, start):
+        """Drop the oldest sample of a channel."""
+        self.leak[row] = self.values[start + self.head[row]]
+        self.leaked[row] = 1
+        self.head[row] = (self.head[row] + 1) % self.max_samples
+        self.count[row] -= 1
+
+    def update(self, row, value, timestamp):
+        """Filter a new sample of a channel."""
+        samples = self.max_samples
+        start = row * samples
+        times, values = self.times, self.values
+
+        while self.count[row] and (
+                times[start + self.head[row]] + self.window_size <= timestamp):
+            self.drop_oldest(row, start)
+        if self.count[row] == samples:
+            self.drop_oldest(row, start)
+
+        head = self.head[row]
+        count = self.count[row] + 1
+        times[start + (head + count - 1) % samples] = timestamp
+        values[start + (head + count - 1) % samples] = value
+        self.count[row] = count
+
+        moving_sum = 0.0
+        left = timestamp - self.window_size
+        previous = self.leak[row] if self.leaked[row] else values[start + head]
+        for i in range(count):
+            index = start + (head + i) % samples
+            moving_sum += (times[index] - left) * previous
+            left = times[index]
+            previous = values[index]
+        return self.round(moving_sum / self.window_size)
+
+    def update_vector(self, rows, values, timestamps):
+        """Filter new samples of distinct channels."""
+        samples = self.max_samples
+        times_view = self.view('times')
+        values_view = self.view('values')
+        head = self.view('head')[:, 0]
+        count = self.view('count')[:, 0]
+        leak = self.view('leak')[:, 0]
+        leaked = self.view('leaked')[:, 0]
+        position = np.arange(samples)
+
+        # samples are stored in time order, leaking drops a prefix
+        order = (head[rows, None] + position) % samples
+        times = times_view[rows[:, None], order]
+        valid = position < count[rows, None]
+        leaking = valid & (times + self.window_size <= timestamps[:, None])
+        dropped = leaking.sum(axis=1)
+        dropped += (count[rows] - dropped) == samples
+        has_leak = dropped > 0
+        last_dropped = (head[rows] + dropped - 1) % samples
+        leak[rows[has_leak]] = values_view[rows[has_leak],
+                                           last_dropped[has_leak]]
+        leaked[rows[has_leak]] = 1
+        head[rows] = (head[rows] + dropped) % samples
+        count[rows] -= dropped
+
+        index = (head[rows] + count[rows]) % samples
+        times_view[rows, index] = timestamps
+        values_view[rows, index] = values
+        count[rows] += 1
+
+        order = (head[rows, None] + position) % samples
+        times = times_view[rows[:, None], order]
+        samples_values = values_view[rows[:, None], order]
+        valid = position < count[rows, None]
+        previous = np.empty_like(samples_values)
+        previous[:, 0] = np.where(leaked[rows] > 0, leak[rows],
+                                  samples_values[:, 0])
+        previous[:, 1:] = samples_values[:, :-1]
+        left = np.empty_like(times)
+        left[:, 0] = timestamps - self.window_size
+        left[:, 1:] = times[:, :-1]
+        terms = np.where(valid, (times - left) * previous, 0.0)
+        # cumulative sum adds terms in order, like the scalar loop
+        moving_sum = np.cumsum(terms, axis=1)[:, -1]
+        return self.round_many(moving_sum / self.window_size)
+
+
+class ThrottleBank(FilterBank):
+    """Throttle filter, passes one sample every window_size samples.
+
+    In between, the last sample passed is returned.
+    """
+
+    def __init__(self, window_size=1, precision=None, entity=None):
+        """Initialize the bank."""
+        super().__init__(window_size, precision, entity)
+        self.add_field('last', 'd', 1)
+        self.add_field('count', 'q', 1)
+
+    def update(self, row, value, timestamp):
+        """Filter a new sample of a channel."""
+        count = self.count[row]
+        if count in (0, self.window_size):
+            self.last[row] = self.round(value)
+            count = 0
+        self.count[row] = count + 1
+        return self.last[row]
+
+    def update_vector(self, rows, values, timestamps):
+        """Filter new samples of distinct channels."""
+        last = self.view('last')[:, 0]
+        count = self.view('count')[:, 0]
+        passed = (count[rows] == 0) | (count[rows] == self.window_size)
+        last[rows[passed]] = self.round_many(values[passed])
+        count[rows] = np.where(passed, 1, count[rows] + 1)
+        return last[rows]
+
 FILTERS = {
-    FILTER_LOWPASS: LowPassFilter,
-    FILTER_OUTLIER: OutlierFilter,
-    FILTER_TIME_SMA: TimeSMAFilter, 
-    FILTER_THROTTLE: ThrottleFilter
+    FILTER_LOWPASS: LowPassBank,
+    FILTER_OUTLIER: OutlierBank,
+    FILTER_TIME_SMA: TimeSMABank,
+    FILTER_THROTTLE: ThrottleBank
     }
 
-class FakeState(object):
-    """Fake HA state."""
-    def __init__(self, value):
-        """Keep value and timestamp."""
-        self.last_updated = dt_util.utcnow() 
-        self.state = value
+class EmissionGate(object):
+    """Decide which samples of an entity are worth a state write.
+
+    The samples of all the measurements of an entity are checked together.
+    They pass when a measurement moved farther than its deadband from the
+    value last passed, but not sooner than min_interval after the last pass,
+    or when max_interval elapsed since the last pass (heartbeat).
+    Measurements without a deadband pass on any change.
+    """
+
+    def __init__(self, deadbands=None, min_interval=0, max_interval=None):
+        """Initialize the gate.
+
+        Args:
+            deadbands (dict): measurement -> (absolute, relative) deadband
+            min_interval (float): seconds between two passes, at least
+            max_interval (float): seconds between two passes, at most
+        """
+        self.deadbands = deadbands or {}
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.last_values = {}
+        self.last_time = None
+        self.emitted = 0
+        self.suppressed = 0
+
+    def changed(self, values):
+        """Return True if a measurement moved out of its deadband."""
+        for measurement, value in values.items():
+            last_value = self.last_values.get(measurement)
+            if value is None or last_value is None:
+                if value is not last_value:
+                    return True
+                continue
+            absolute, relative = self.deadbands.get(measurement, (0, 0))
+            delta = abs(value - last_value)
+            if delta > absolute and delta > relative * abs(last_value):
+                return True
+        return False
+
+    def check(self, values, timestamp):
+        """Return True if the samples should be written to the state.
+
+        Args:
+            values (dict): measurement -> sample
+            timestamp (float): monotonic time of the samples
+        """
+        if self.last_time is not None:
+            elapsed = timestamp - self.last_time
+            if elapsed < self.min_interval or (
+                    (self.max_interval is None or elapsed < self.max_interval)
+                    and not self.changed(values)):
+                self.suppressed += 1
+                return False
+
+        self.last_values = values
+        self.last_time = timestamp
+        self.emitted += 1
+        return True
 
 class Filter(object):
-    """Filter decorator."""
+    """Filter decorator.
 
-    def __init__(self, filter_algorithm, **kwargs):
+    Filter state is kept per entity (keyed by entity_id), so every entity
+    decorated by the same Filter has its own row in the filter bank, which
+    is only created when the first sample arrives.
+    """
+
+    decorators = []
+
+    def __init__(self, filter_algorithm, max_entities=MAX_ENTITIES, **kwargs):
         """Decorator constructor, selects algorithm and configures window.
 
         Args:
             filter_algorithm (string): must be one of the defined filters
+            max_entities (int): maximum number of entities tracked, the least
+                recently updated entity is evicted beyond this limit
             kwargs (dict): arguments to be passed to the specific filter
         """
-        try:
-            module_name = inspect.stack()[1][0].f_globals['__name__']
-            Filter.logger = logging.getLogger(module_name)
-            Filter.logger.debug("Filter %s(%s) on %s", filter_algorithm, kwargs,
-                                module_name)
-        except:
-            Filter.logger = logging.getLogger("custom_components")
-
-        if filter_algorithm in FILTERS:
-            self.filter = FILTERS[filter_algorithm](**kwargs)
-        else:
+        self.logger = _LOGGER
+        self.filter_algorithm = filter_algorithm
+        self.filter_kwargs = kwargs
+        self.max_entities = max_entities
+        self.bank = None
+        self.filters = OrderedDict()
+        self.inner = None
+
+        if filter_algorithm not in FILTERS:
             self.logger.error("Unknown filter <%s>", filter_algorithm)
 
+        Filter.decorators.append(self)
+
+    def get_filter(self, entity_id):
+        """Return the bank row of entity_id, creating it if needed."""
+        try:
+            self.filters.move_to_end(entity_id)
+            return self.filters[entity_id]
+        except KeyError:
+            pass
+
+        if self.bank is None:
+            self.bank = FILTERS[self.filter_algorithm](**self.filter_kwargs)
+
+        if len(self.filters) >= self.max_entities:
+            evicted, evicted_row = self.filters.popitem(last=False)
+            self.bank.release(evicted_row)
+            self.logger.warning("Too many entities, dropping %s filter of %s",
+                                self.filter_algorithm, evicted)
+
+        row = self.filters[entity_id] = self.bank.allocate()
+        return row
+
+    @classmethod
+    def evict(cls, entity_id):
+        """Drop the filter state of a removed entity."""
+        for decorator in cls.decorators:
+            if entity_id in decorator.filters:
+                decorator.bank.release(decorator.filters.pop(entity_id))
+
+    @classmethod
+    def snapshot(cls, entity_id):
+        """Return the filter state of an entity in a compact binary form."""
+        now = monotonic()
+        chunks = [SNAPSHOT_HEADER.pack(SNAPSHOT_VERSION)]
+        for decorator in cls.decorators:
+            row = decorator.filters.get(entity_id)
+            if row is None:
+                continue
+            name = decorator.name.encode()
+            data = decorator.bank.pack_row(row, now)
+            chunks.extend((SNAPSHOT_ENTRY.pack(len(name), len(data)),
+                           name, data))
+        return b''.join(chunks)
+
+    @classmethod
+    def restore(cls, entity_id, snapshot, age=0):
+        """Restore the filter state of an entity from a snapshot.
+
+        Args:
+            entity_id (string): entity the snapshot was taken from
+            snapshot (bytes): data returned by snapshot()
+            age (float): seconds elapsed since the snapshot was taken
+        """
+        decorators = {decorator.name: decorator
+                      for decorator in cls.decorators
+                      if decorator.filter_algorithm in FILTERS}
+        now = monotonic() - age
+        version, = SNAPSHOT_HEADER.unpack_from(snapshot)
+        if version != SNAPSHOT_VERSION:
+            _LOGGER.warning("Ignoring filter snapshot version %s of %s",
+                            version, entity_id)
+            return
+
+        offset = SNAPSHOT_HEADER.size
+        while offset < len(snapshot):
+            name_size, data_size = SNAPSHOT_ENTRY.unpack_from(snapshot, offset)
+            offset += SNAPSHOT_ENTRY.size
+            name = snapshot[offset:offset + name_size].decode()
+            offset += name_size
+            data = snapshot[offset:offset + data_size]
+            offset += data_size
+
+            decorator = decorators.get(name)
+            if decorator is None:
+                continue
+            row = decorator.get_filter(entity_id)
+            try:
+                decorator.bank.unpack_row(row, data, now)
+            except ValueError as err:
+                decorator.bank.release(decorator.filters.pop(entity_id))
+                _LOGGER.warning("Ignoring %s snapshot of %s: %s", name,
+                                entity_id, err)
+
+    def filter_many(self, entity_ids, values, timestamps=None):
+        """Filter a burst of samples of several entities at once.
+
+        Samples go through the stacked Filter decorators innermost first,
+        like one sample at a time does. Samples that are not numbers are
+        filtered to None.
+        """
+        if timestamps is None:
+            timestamps = [monotonic()] * len(values)
+        if self.inner is not None:
+            values = self.inner.filter_many(entity_ids, values, timestamps)
+        if self.filter_algorithm not in FILTERS:
+            return list(values)
+
+        filtered = [None] * len(values)
+        indices, rows, samples, sample_timestamps = [], [], [], []
+        for index, (entity_id, value, timestamp) in enumerate(
+                zip(entity_ids, values, timestamps)):
+            try:
+                sample = float(value)
+            except (TypeError, ValueError):
+                continue
+            indices.append(index)
+            rows.append(self.get_filter(entity_id))
+            samples.append(sample)
+            sample_timestamps.append(timestamp)
+        if rows:
+            for index, value in zip(indices, self.bank.update_many(
+                    rows, samples, sample_timestamps)):
+                filtered[index] = value
+        return filtered
+
     def __call__(self, func):
-        """Decorate function as filter."""
-        def func_wrapper(sensor_object):
-            """Wrap for the original state() function."""
-            new_state = FakeState(func(sensor_object))
+        """Decorate function as filter.
+
+        The decorated function receives each new sample as it arrives, the
+        filtered value is returned so the caller can cache it. Samples are
+        plain floats with a monotonic timestamp taken once per sample and
+        handed down the stacked Filter decorators.
+        """
+        self.logger = logging.getLogger(func.__module__)
+        self.logger.debug("Filter %s(%s) on %s", self.filter_algorithm,
+                          self.filter_kwargs, func.__qualname__)
+        chained = isinstance(getattr(func, 'filter', None), Filter)
+        self.depth = func.filter.depth + 1 if chained else 0
+        self.inner = func.filter if chained else None
+        self.name = "{}:{}:{}".format(func.__qualname__, self.depth,
+                                      self.filter_algorithm)
+
+        def func_wrapper(sensor_object, value, timestamp=None):
+            """Wrap the function feeding a new sample to the filter."""
+            if timestamp is None:
+                timestamp = monotonic()
+            if chained:
+                raw_value = func(sensor_object, value, timestamp)
+            else:
+                raw_value = func(sensor_object, value)
+            if self.filter_algorithm not in FILTERS:
+                return raw_value
+
+            row = self.get_filter(sensor_object.entity_id)
             try:
-                filtered_state = self.filter.filter_state(new_state)
-            except TypeError:
+                filtered = self.bank.update(row, float(raw_value), timestamp)
+            except (TypeError, ValueError):
                 return None
 
-            Filter.logger.debug("%s(%s) -> %s", sensor_object.entity_id,
-                                new_state.state, filtered_state.state)
-            return filtered_state.state
+            if self.logger.isEnabledFor(logging.DEBUG):
+                self.logger.debug("%s(%s) -> %s", sensor_object.entity_id,
+                                  raw_value, filtered)
+            return filtered
 
+        func_wrapper.filter = self
+        func_wrapper.__qualname__ = func.__qualname__
         return func_wrapper
@@ -0,0 +1,557 @@
+"""
+HomeGW integration, reads the gateway and shares it with the HomeGW platforms.
+
+Configuration:
+
+homegw:
+  serial_port: /dev/ttyUSB0
+  baudrate: 115200
+  record: /config/homegw.log
+
+https://github.com/dgomes/homeGW
+"""
+import asyncio
+import base64
+import logging
+import time
+from collections import OrderedDict
+from datetime import timedelta
+
+import voluptuous as vol
+
+from homeassistant.const import (
+    EVENT_HOMEASSISTANT_STOP, STATE_UNKNOWN, STATE_UNAVAILABLE)
+from homeassistant.core import callback
+from homeassistant.helpers import discovery
+import homeassistant.helpers.config_validation as cv
+from homeassistant.helpers.dispatcher import async_dispatcher_send
+from homeassistant.helpers.event import (
+    async_track_state_change, async_track_time_interval)
+from homeassistant.helpers.storage import Store
+
+from .frames import FrameRecorder, decode
+
+_LOGGER = logging.getLogger(__name__)
+
+DOMAIN = 'homegw'
+
+CONF_SERIAL_PORT = 'serial_port'
+CONF_BAUDRATE = 'baudrate'
+CONF_DISCOVERY = 'discovery'
+CONF_RECORD = 'record'
+
+DEFAULT_BAUDRATE = 115200
+
+DATA_DISPATCHERS = 'dispatchers'
+DATA_FILTER_STORE = 'filter_store'
+DATA_HUB = 'hub'
+DATA_RECORDER = 'recorder'
+
+SIGNAL_NEW_DEVICE = DOMAIN + '_new_device'
+
+DISCOVERY_PLATFORMS = ['climate', 'weather']
+
+READ_SIZE = 1024
+MAX_LINE_LENGTH = 512
+RECONNECT_MIN_DELAY = 1
+RECONNECT_MAX_DELAY = 60
+
+STORAGE_KEY = DOMAIN + '.filters'
+STORAGE_VERSION = 1
+
+SNAPSHOT_INTERVAL = timedelta(minutes=10)
+SNAPSHOT_MAX_AGE = timedelta(hours=12)
+
+DEDUP_WINDOW = 2.0
+DEDUP_MAX_FRAMES = 256
+STATS_INTERVAL = 1000
+
+MAX_DEVICES = 64
+DEVICE_TTL = 3600
+DISCOVERY_MIN_PACKETS = 3
+DISCOVERY_INTERVAL = 60
+
+ATTR_SAVED = 'saved'
+ATTR_FILTERS = 'filters'
+
+
+CONFIG_SCHEMA = vol.Schema({
+    DOMAIN: vol.Schema({
+        vol.Optional(CONF_SERIAL_PORT): cv.string,
+        vol.Optional(CONF_BAUDRATE, default=DEFAULT_BAUDRATE):
+            cv.positive_int,
+        vol.Optional(CONF_DISCOVERY, default=False): cv.boolean,
+        vol.Optional(CONF_RECORD): cv.string,
+    }),
+}, extra=vol.ALLOW_EXTRA)
+
+
+async def async_setup(hass, config):
+    """Start reading and recording the gateway, if configured."""
+    if DOMAIN not in config:
+        return True
+    conf = config[DOMAIN]
+
+    if CONF_RECORD in conf:
+        recorder = await hass.async_add_executor_job(
+            FrameRecorder, conf[CONF_RECORD])
+        data = hass.data.setdefault(DOMAIN, {})
+        data[DATA_RECORDER] = recorder
+        for dispatcher in data.get(DATA_DISPATCHERS, {}).values():
+            dispatcher.recorder = recorder
+
+        @callback
+        def async_stop_recording(event):
+            """Flush the frames log."""
+            _LOGGER.info("Recorded %d frames to %s",
+                         recorder.records, conf[CONF_RECORD])
+            hass.async_add_executor_job(recorder.close)
+
+        hass.bus.async_listen_once(
+            EVENT_HOMEASSISTANT_STOP, async_stop_recording)
+
+    if CONF_SERIAL_PORT not in conf:
+        return True
+
+    dispatcher = async_get_dispatcher(hass, None)
+    hub = SerialHub(
+        dispatcher, conf[CONF_SERIAL_PORT], conf[CONF_BAUDRATE])
+    hass.data[DOMAIN][DATA_HUB] = hub
+
+    if conf[CONF_DISCOVERY]:
+        dispatcher.discovery = True
+        for platform in DISCOVERY_PLATFORMS:
+            hass.async_create_task(discovery.async_load_platform(
+                hass, platform, DOMAIN, {}, config))
+
+    task = hass.loop.create_task(hub.async_run())
+
+    @callback
+    def async_stop(event):
+        """Stop reading the gateway."""
+        task.cancel()
+
+    hass.bus.async_listen_once(EVENT_HOMEASSISTANT_STOP, async_stop)
+    return True
+
+
+@callback
+def async_get_dispatcher(hass, serial_sensor):
+    """Return the payload dispatcher of a serial sensor.
+
+    The dispatcher of serial_sensor None is fed by the SerialHub.
+    """
+    data = hass.data.setdefault(DOMAIN, {})
+    dispatchers = data.setdefault(DATA_DISPATCHERS, {})
+    if serial_sensor not in dispatchers:
+        dispatchers[serial_sensor] = PayloadDispatcher(hass, serial_sensor)
+        dispatchers[serial_sensor].recorder = data.get(DATA_RECORDER)
+    return dispatchers[serial_sensor]
+
+
+class Device(object):
+    """A device heard by the gateway."""
+
+    __slots__ = ('first_seen', 'last_seen', 'packets', 'battery',
+                 'announced')
+
+    def __init__(self, now):
+        """Initialize a device first seen now."""
+        self.first_seen = self.last_seen = now
+        self.packets = 0
+        self.battery = None
+        self.announced = None
+
+    @property
+    def rate(self):
+        """Return the packets received per minute."""
+        return 60 * self.packets / max(self.last_seen - self.first_seen, 60)
+
+
+class DeviceTable(object):
+    """Bounded table of the devices heard by the gateway.
+
+    Devices not heard for DEVICE_TTL seconds expire, and the least recently
+    heard device is dropped beyond MAX_DEVICES, so the sensors of the
+    neighbours can't grow it without limit.
+    """
+
+    def __init__(self, max_devices=MAX_DEVICES, ttl=DEVICE_TTL):
+        """Initialize the table."""
+        self.max_devices = max_devices
+        self.ttl = ttl
+        self._devices = OrderedDict()
+
+    def __len__(self):
+        """Return the number of devices."""
+        return len(self._devices)
+
+    def __iter__(self):
+        """Iterate over the (dev, ch, id), device pairs."""
+        return iter(self._devices.items())
+
+    def seen(self, key, battery, now):
+        """Record a packet of a device, returns the device."""
+        device = self._devices.pop(key, None)
+        if device is None:
+            device = Device(now)
+            _LOGGER.debug("New device %s", key)
+        device.last_seen = now
+        device.packets += 1
+        device.battery = battery
+        self._devices[key] = device
+
+        while len(self._devices) > 1:
+            oldest, oldest_device = next(iter(self._devices.items()))
+            if (len(self._devices) <= self.max_devices and
+                    oldest_device.last_seen + self.ttl > now):
+                break
+            del self._devices[oldest]
+        return device
+
+
+class PayloadDispatcher(object):
+    """Parse the payloads of a serial sensor and route them to entities.
+
+    Each payload is decoded once into a Frame and handed to the callbacks
+    registered for its (dev, ch), and for its dev with any channel. 433MHz
+    sensors repeat every frame several times: a payload identical to one
+    seen in the last DEDUP_WINDOW seconds is dropped before being decoded.
+
+    A burst of payloads (several lines in one read of the gateway) is
+    routed at once: the frames for callbacks registered with a
+    burst_callback are handed to it together, so entities can filter them
+    in one go.
+
+    Every device heard is kept in a DeviceTable. With discovery on, devices
+    heard DISCOVERY_MIN_PACKETS times that no entity is registered for are
+    announced (SIGNAL_NEW_DEVICE) so the platforms create their entities.
+
+    With a recorder, every payload (repeats included) is appended to its log.
+
+    clock returns the (monotonic) time payloads are received at, for the
+    duplicate window, the devices and the entities; a replay sets it to the
+    time of the log.
+    """
+
+    def __init__(self, hass, serial_sensor):
+        """Initialize the dispatcher."""
+        self._hass = hass
+        self._serial_sensor = serial_sensor
+        self._routes = {}
+        self._bursts = {}
+        self._remove_listener = None
+        self._recent = OrderedDict()
+        self.frames = 0
+        self.duplicates = 0
+        self.devices = DeviceTable()
+        self.discovery = False
+        self.recorder = None
+        self.clock = time.monotonic
+
+    @callback
+    def async_register(self, dev, channel, payload_callback,
+                       burst_callback=None):
+        """Route the payloads of dev and channel (None for any channel).
+
+        payload_callback gets each Frame. In a burst, burst_callback (if
+        any) gets instead the list of (payload_callback, Frame) of all the
+        callbacks registered with it, in arrival order.
+
+        Returns a callback to unregister.
+        """
+        key = (dev, channel)
+        self._routes[key] = self._routes.get(key, ()) + (payload_callback,)
+        if burst_callback is not None:
+            self._bursts[payload_callback] = burst_callback
+        if self._remove_listener is None and self._serial_sensor is not None:
+            self._remove_listener = async_track_state_change(
+                self._hass, self._serial_sensor, self._sensor_changed)
+
+        @callback
+        def async_unregister():
+            """Stop routing payloads to payload_callback."""
+            callbacks = tuple(registered for registered in self._routes[key]
+                              if registered is not payload_callback)
+            if callbacks:
+                self._routes[key] = callbacks
+            else:
+                del self._routes[key]
+            self._bursts.pop(payload_callback, None)
+            if not self._routes and self._remove_listener is not None:
+                self._remove_listener()
+                self._remove_listener = None
+
+        return async_unregister
+
+    @callback
+    def _sensor_changed(self, entity_id, old_state, new_state):
+        """Handle serial sensor state changes."""
+        if new_state is None:
+            return
+        elif new_state.state in [STATE_UNKNOWN, STATE_UNAVAILABLE]:
+            return
+        self.async_feed(new_state.state)
+
+    def is_duplicate(self, raw, now):
+        """Return True if raw was already seen within DEDUP_WINDOW."""
+        recent = self._recent
+        while recent:
+            oldest, seen = next(iter(recent.items()))
+            if seen + DEDUP_WINDOW > now and len(recent) < DEDUP_MAX_FRAMES:
+                break
+            del recent[oldest]
+
+        self.frames += 1
+        if self.frames % STATS_INTERVAL == 0:
+            _LOGGER.debug("%s: %d frames, %.1f%% duplicates",
+                          self._serial_sensor, self.frames,
+                          100 * self.duplicates / self.frames)
+        if raw in recent:
+            self.duplicates += 1
+            return True
+        recent[raw] = now
+        return False
+
+    @callback
+    def async_feed(self, raw):
+        """Decode a payload and hand it to the interested entities."""
+        routed = self._route(raw, self.clock())
+        if routed is None:
+            return
+        frame, callbacks = routed
+        for frame_callback in callbacks:
+            frame_callback(frame)
+
+    @callback
+    def async_feed_many(self, raws):
+        """Decode a burst of payloads and hand them to the entities.
+
+        A payload or burst callback that raises is logged, the others go on.
+        """
+        now = self.clock()
+        bursts = OrderedDict()
+        for raw in raws:
+            try:
+                routed = self._route(raw, now)
+                if routed is None:
+                    continue
+                frame, callbacks = routed
+                for frame_callback in callbacks:
+                    burst_callback = self._bursts.get(frame_callback)
+                    if burst_callback is None:
+                        frame_callback(frame)
+                    else:
+                        bursts.setdefault(burst_callback, []).append(
+                            (frame_callback, frame))
+            except Exception:
+                _LOGGER.exception("Error handling %s", raw)
+        for burst_callback, burst in bursts.items():
+            try:
+                burst_callback(burst)
+            except Exception:
+                _LOGGER.exception("Error handling a burst of %d frames",
+                                  len(burst))
+
+    def _route(self, raw, now):
+        """Decode a payload, returns its (Frame, callbacks) or None.
+
+        Records the payload, drops repeats and announces new devices.
+        """
+        if self.recorder is not None:
+            self.recorder.record(time.time(), raw)
+        if self.is_duplicate(raw, now):
+            return None
+
+        try:
+            frame = decode(raw)
+        except ValueError:
+            _LOGGER.warning("Could not process: %s", raw)
+            return None
+
+        dev = frame.dev
+        channel = frame.ch
+        device = self.devices.seen((dev, channel, frame.id), frame.batt, now)
+
+        routes = self._routes
+        callbacks = routes.get((dev, channel), ()) + routes.get((dev, None), ())
+
+        if (not callbacks and self.discovery and
+                device.packets >= DISCOVERY_MIN_PACKETS and
+                (device.announced is None or
+                 device.announced + DISCOVERY_INTERVAL < now)):
+            device.announced = now
+            async_dispatcher_send(self._hass, SIGNAL_NEW_DEVICE, dev, channel)
+        return frame, callbacks
+
+
+class SerialHub(object):
+    """Read the payloads of the gateway straight from its serial port.
+
+    Lines are framed as bytes arrive and fed to the dispatcher, without going
+    through a serial sensor entity. The port is reopened, with an increasing
+    delay, whenever it fails or closes without a line read. Lines longer
+    than MAX_LINE_LENGTH are dropped, a payload that fails to be handled is
+    logged and the next one goes on. serial_port is a pyserial URL, so a pty
+    can stand in for the gateway.
+    """
+
+    def __init__(self, dispatcher, serial_port, baudrate):
+        """Initialize the hub."""
+        self._dispatcher = dispatcher
+        self._serial_port = serial_port
+        self._baudrate = baudrate
+        self.lines = 0
+
+    async def async_run(self):
+        """Read the gateway until cancelled."""
+        import serial_asyncio
+        from serial import SerialException
+
+        delay = RECONNECT_MIN_DELAY
+        while True:
+            try:
+                reader, writer = await serial_asyncio.open_serial_connection(
+                    url=self._serial_port, baudrate=self._baudrate)
+            except SerialException as err:
+                _LOGGER.error("Unable to open %s, retrying in %d s: %s",
+                              self._serial_port, delay, err)
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, RECONNECT_MAX_DELAY)
+                continue
+
+            _LOGGER.info("Reading HomeGW on %s", self._serial_port)
+            lines = self.lines
+            try:
+                await self._async_read(reader)
+            except SerialException as err:
+                _LOGGER.error("Error reading %s: %s", self._serial_port, err)
+            except Exception:
+                _LOGGER.exception("Unexpected error reading %s",
+                                  self._serial_port)
+            finally:
+                writer.close()
+            if self.lines > lines:
+                delay = RECONNECT_MIN_DELAY
+            _LOGGER.info("Reopening %s in %d s", self._serial_port, delay)
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, RECONNECT_MAX_DELAY)
+
+    async def _async_read(self, reader):
+        """Frame lines and feed them to the dispatcher until EOF."""
+        buffer = b''
+        while True:
+            chunk = await reader.read(READ_SIZE)
+            if not chunk:
+                _LOGGER.warning("%s closed", self._serial_port)
+                return
+
+            *lines, buffer = (buffer + chunk).split(b'\n')
+            if len(buffer) > MAX_LINE_LENGTH:
+                _LOGGER.warning("Dropping %d bytes without end of line",
+                                len(buffer))
+                buffer = b''
+            payloads = []
+            for line in lines:
+                line = line.strip()
+                if len(line) > MAX_LINE_LENGTH:
+                    _LOGGER.warning("Dropping a line of %d bytes", len(line))
+                elif line:
+                    payloads.append(line.decode('ascii', errors='replace'))
+            self.lines += len(payloads)
+            if len(payloads) == 1:
+                self._feed(payloads[0])
+            elif payloads:
+                # A backlog, e.g. after reconnecting, is filtered at once
+                self._dispatcher.async_feed_many(payloads)
+
+    def _feed(self, payload):
+        """Feed a payload, logging the errors of its entities."""
+        try:
+            self._dispatcher.async_feed(payload)
+        except Exception:
+            _LOGGER.exception("Error handling %s", payload)
+
+
+async def async_get_filter_store(hass):
+    """Return the filter store shared by the HomeGW entities."""
+    data = hass.data.setdefault(DOMAIN, {})
+    if DATA_FILTER_STORE not in data:
+        data[DATA_FILTER_STORE] = hass.async_create_task(
+            _async_load_filter_store(hass))
+    return await data[DATA_FILTER_STORE]
+
+
+async def _async_load_filter_store(hass):
+    """Load the filter store and schedule its snapshots."""
+    store = FilterStore(hass)
+    await store.async_load()
+
+    async_track_time_interval(hass, store.async_save, SNAPSHOT_INTERVAL)
+    hass.bus.async_listen_once(EVENT_HOMEASSISTANT_STOP, store.async_save)
+    return store
+
+
+class FilterStore(object):
+    """Persist the filter windows of the HomeGW entities across restarts.
+
+    Snapshots are the binary blobs of filter_helper.Filter.snapshot(), kept
+    base64 encoded in the .storage directory.
+    """
+
+    def __init__(self, hass):
+        """Initialize the store."""
+        self._store = Store(hass, STORAGE_VERSION, STORAGE_KEY)
+        self._snapshots = {}
+        self._entities = {}
+
+    async def async_load(self):
+        """Load the snapshots saved by the previous run."""
+        data = await self._store.async_load() or {}
+        oldest = time.time() - SNAPSHOT_MAX_AGE.total_seconds()
+        self._snapshots = {
+            entity_id: snapshot for entity_id, snapshot in data.items()
+            if snapshot[ATTR_SAVED] > oldest}
+
+    @callback
+    def async_restore(self, entity_id):
+        """Return the (snapshot, age in seconds) of an entity, or None."""
+        snapshot = self._snapshots.get(entity_id)
+        if snapshot is None:
+            return None
+        return (base64.b64decode(snapshot[ATTR_FILTERS]),
+                max(0, time.time() - snapshot[ATTR_SAVED]))
+
+    @callback
+    def async_register(self, entity_id, snapshot_callback):
+        """Snapshot the filters of an entity with every save.
+
+        Returns a callback that takes a last snapshot and unregisters.
+        """
+        self._entities[entity_id] = snapshot_callback
+
+        @callback
+        def async_unregister():
+            """Take a last snapshot of the entity and stop tracking it."""
+            self._take_snapshot(entity_id)
+            self._entities.pop(entity_id, None)
+
+        return async_unregister
+
+    def _take_snapshot(self, entity_id):
+        """Take a snapshot of the filters of a registered entity."""
+        snapshot_callback = self._entities.get(entity_id)
+        if snapshot_callback is None:
+            return
+        self._snapshots[entity_id] = {
+            ATTR_SAVED: time.time(),
+            ATTR_FILTERS: base64.b64encode(snapshot_callback()).decode(),
+        }
+
+    async def async_save(self, *_):
+        """Snapshot all registered entities and save."""
+        for entity_id in list(self._entities):
+            self._take_snapshot(entity_id)
+        _LOGGER.debug("Saving filter snapshots of %d entities",
+                      len(self._snapshots))
+        await self._store.async_save(self._snapshots)
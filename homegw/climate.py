@@ -3,9 +3,8 @@ HomeGW platform that offers meteorological data.
 
 https://github.com/dgomes/homeGW
 """
-import asyncio
 import logging
-import json
+from datetime import timedelta
 import voluptuous as vol
 
 from homeassistant.components.climate import (
@@ -15,6 +14,7 @@ from homeassistant.components.climate import (
 from homeassistant.const import (
     TEMP_CELSIUS, CONF_NAME, STATE_ON)
 from homeassistant.core import callback
+from homeassistant.helpers.dispatcher import async_dispatcher_connect
 from homeassistant.helpers.event import async_track_state_change
 from homeassistant.helpers.restore_state import async_get_last_state
 import homeassistant.helpers.config_validation as cv
@@ -22,7 +22,12 @@ import homeassistant.helpers.config_validation as cv
 import os
 import sys
 sys.path.append(os.sep.join(os.path.abspath(__file__).split(os.sep)[:-2]))
-from filter_helper import Filter, FILTER_OUTLIER, FILTER_LOWPASS
+from filter_helper import (
+    Filter, EmissionGate, FILTER_OUTLIER, FILTER_LOWPASS)
+
+from . import (
+    DOMAIN, DATA_HUB, SIGNAL_NEW_DEVICE, async_get_dispatcher,
+    async_get_filter_store)
 
 _LOGGER = logging.getLogger(__name__)
 
@@ -32,6 +37,14 @@ CONF_SERIAL_ENTITY = 'serial_sensor'
 CONF_HEATING_ENTITY = 'heating_sensor'
 CONF_DEV_CHANNEL = 'channel'
 CONF_TARGET_TEMP = 'target_temp'
+CONF_DEADBAND = 'deadband'
+CONF_ABSOLUTE = 'absolute'
+CONF_RELATIVE = 'relative'
+CONF_MIN_INTERVAL = 'min_interval'
+CONF_MAX_INTERVAL = 'max_interval'
+
+MEASUREMENT_TEMPERATURE = 'temperature'
+MEASUREMENT_HUMIDITY = 'humidity'
 
 ATTR_HOMEGW_DEV = 'dev'
 ATTR_HOMEGW_TEMPERATURE = 'temp'
@@ -39,32 +52,74 @@ ATTR_HOMEGW_HUMIDITY = 'hum'
 ATTR_HOMEGW_ID = 'id'
 ATTR_HOMEGW_CHANNEL = 'ch'
 ATTR_HOMEGW_BATTERY = 'batt'
+ATTR_EMITTED_UPDATES = 'emitted_updates'
+ATTR_SUPPRESSED_UPDATES = 'suppressed_updates'
 
 DEFAULT_NAME = "HomeGW thermostat"
+DEFAULT_MAX_INTERVAL = timedelta(minutes=10)
 
 VALUE_HOMEGW_DEV_DIGOO = 'digoo'
 
+DEADBAND_SCHEMA = vol.Schema({
+    vol.Optional(CONF_ABSOLUTE, default=0): vol.Coerce(float),
+    vol.Optional(CONF_RELATIVE, default=0): vol.Coerce(float),
+})
+
 PLATFORM_SCHEMA = PLATFORM_SCHEMA.extend({
-    vol.Required(CONF_SERIAL_ENTITY): cv.entity_id,
+    vol.Optional(CONF_SERIAL_ENTITY): cv.entity_id,
     vol.Required(CONF_DEV_CHANNEL): cv.positive_int,
     vol.Optional(CONF_HEATING_ENTITY): cv.entity_id,
     vol.Optional(CONF_NAME, default=DEFAULT_NAME): cv.string,
     vol.Optional(CONF_TARGET_TEMP): vol.Coerce(float),
+    vol.Optional(CONF_DEADBAND, default={}): vol.Schema({
+        vol.Optional(MEASUREMENT_TEMPERATURE): DEADBAND_SCHEMA,
+        vol.Optional(MEASUREMENT_HUMIDITY): DEADBAND_SCHEMA,
+    }),
+    vol.Optional(CONF_MIN_INTERVAL, default=timedelta(0)): cv.time_period,
+    vol.Optional(CONF_MAX_INTERVAL,
+                 default=DEFAULT_MAX_INTERVAL): cv.time_period,
 })
 
 
-@asyncio.coroutine
-def async_setup_platform(hass, config, async_add_devices, discovery_info=None):
+async def async_setup_platform(hass, config, async_add_devices, discovery_info=None):
     """Set up homeGW climate devices."""
-    serial_sensor = config[CONF_SERIAL_ENTITY]
+    if discovery_info is not None:
+        discovered = set()
+
+        @callback
+        def async_new_device(dev, channel):
+            """Add a thermostat for a newly heard channel."""
+            if dev != VALUE_HOMEGW_DEV_DIGOO or channel in discovered:
+                return
+            discovered.add(channel)
+            async_add_devices([
+                HomeGWClimate(hass, "{} {}".format(DEFAULT_NAME, channel),
+                              None, None, channel, None,
+                              EmissionGate(max_interval=DEFAULT_MAX_INTERVAL
+                                           .total_seconds()))
+            ])
+
+        async_dispatcher_connect(hass, SIGNAL_NEW_DEVICE, async_new_device)
+        return
+
+    serial_sensor = config.get(CONF_SERIAL_ENTITY)
+    if serial_sensor is None and DATA_HUB not in hass.data.get(DOMAIN, {}):
+        _LOGGER.error("No serial_sensor given and %s is not configured",
+                      DOMAIN)
+        return
     dev_channel = config[CONF_DEV_CHANNEL]
     heating_sensor = config.get(CONF_HEATING_ENTITY)
     name = config.get(CONF_NAME, DEFAULT_NAME)
     target_temp = config.get(CONF_TARGET_TEMP)
+    gate = EmissionGate(
+        {measurement: (deadband[CONF_ABSOLUTE], deadband[CONF_RELATIVE])
+         for measurement, deadband in config[CONF_DEADBAND].items()},
+        config[CONF_MIN_INTERVAL].total_seconds(),
+        config[CONF_MAX_INTERVAL].total_seconds())
 
     async_add_devices([
         HomeGWClimate(hass, name, serial_sensor,
-                      heating_sensor, dev_channel, target_temp)
+                      heating_sensor, dev_channel, target_temp, gate)
     ])
 
 
@@ -72,9 +127,11 @@ class HomeGWClimate(ClimateDevice):
     """Representation of a demo climate device."""
 
     def __init__(self, hass, name, serial_sensor,
-                 heating_sensor, dev_channel, target_temp):
+                 heating_sensor, dev_channel, target_temp, gate):
         """Initialize the climate device."""
         self._name = name
+        self._gate = gate
+        self._dispatcher = None
         self._channel = dev_channel
         self._id = None
         self._battery = None
@@ -88,13 +145,17 @@ class HomeGWClimate(ClimateDevice):
         self._humidity = None
         self._target_humidity = 50
 
-        async_track_state_change(hass, serial_sensor, self._sensor_changed)
-        async_track_state_change(hass, heating_sensor, self._heating_changed)
+        self._serial_sensor = serial_sensor
+        self._version = 0
+        self._attrs = self._attrs_version = None
+        self._listeners = []
+        if heating_sensor is not None:
+            self._listeners.append(async_track_state_change(
+                hass, heating_sensor, self._heating_changed))
 
-    @asyncio.coroutine
-    def async_added_to_hass(self):
+    async def async_added_to_hass(self):
         """Run when entity about to be added."""
-        old_state = yield from async_get_last_state(self.hass, self.entity_id)
+        old_state = await async_get_last_state(self.hass, self.entity_id)
         if old_state is not None:
             _LOGGER.debug("Loading %s old_state: %s",
                           self.entity_id, old_state)
@@ -105,6 +166,27 @@ class HomeGWClimate(ClimateDevice):
                 self._current_humidity = int(
                     old_state.attributes[ATTR_CURRENT_HUMIDITY])
 
+        self._version += 1
+
+        filter_store = await async_get_filter_store(self.hass)
+        snapshot = filter_store.async_restore(self.entity_id)
+        if snapshot is not None:
+            Filter.restore(self.entity_id, *snapshot)
+        self._listeners.append(filter_store.async_register(
+            self.entity_id, lambda: Filter.snapshot(self.entity_id)))
+
+        dispatcher = self._dispatcher = async_get_dispatcher(
+            self.hass, self._serial_sensor)
+        self._listeners.append(dispatcher.async_register(
+            VALUE_HOMEGW_DEV_DIGOO, self._channel, self._sensor_changed,
+            HomeGWClimate._sensors_changed))
+
+    async def async_will_remove_from_hass(self):
+        """Run when entity will be removed."""
+        for remove_listener in self._listeners:
+            remove_listener()
+        Filter.evict(self.entity_id)
+
     @callback
     def _heating_changed(self, entity_id, old_state, new_state):
         """Handle sensor state changes."""
@@ -120,32 +202,45 @@ class HomeGWClimate(ClimateDevice):
         self.schedule_update_ha_state()
 
     @callback
-    def _sensor_changed(self, entity_id, old_state, new_state):
-        """Handle sensor state changes."""
-        if new_state is None:
-            return
-        elif new_state.state == STATE_UNKNOWN:
+    def _sensor_changed(self, frame):
+        """Handle a frame of this device and channel."""
+        _LOGGER.debug("%s : %s", self._channel, frame)
+        timestamp = self._dispatcher.clock()
+        self._frame_filtered(
+            frame, self._filter_temperature(frame.temp, timestamp),
+            self._filter_humidity(frame.hum, timestamp), timestamp)
+
+    @classmethod
+    def _sensors_changed(cls, burst):
+        """Handle a burst of frames, filtering all thermostats at once."""
+        entities = [sensor_changed.__self__ for sensor_changed, _ in burst]
+        timestamp = entities[0]._dispatcher.clock()
+        entity_ids = [entity.entity_id for entity in entities]
+        timestamps = [timestamp] * len(burst)
+        temperatures = cls._filter_temperature.filter.filter_many(
+            entity_ids, [frame.temp for _, frame in burst], timestamps)
+        humidities = cls._filter_humidity.filter.filter_many(
+            entity_ids, [frame.hum for _, frame in burst], timestamps)
+        for entity, (_, frame), temperature, humidity in zip(
+                entities, burst, temperatures, humidities):
+            entity._frame_filtered(frame, temperature, humidity, timestamp)
+
+    def _frame_filtered(self, frame, temperature, humidity, timestamp):
+        """Take a frame with its filtered measurements."""
+        self._version += 1
+        self._current_temperature = temperature
+        self._current_humidity = humidity
+        self._id = frame.id
+        self._channel = frame.ch
+        self._battery = frame.batt
+
+        if not self._gate.check({
+                MEASUREMENT_TEMPERATURE: self._current_temperature,
+                MEASUREMENT_HUMIDITY: self._current_humidity,
+                ATTR_HOMEGW_ID: self._id,
+                ATTR_HOMEGW_BATTERY: self._battery}, timestamp):
             return
 
-        try:
-            payload = json.loads(new_state.state)
-        except Exception:
-            _LOGGER.warning("Could not process: %s", new_state.state)
-            return
-
-        if payload[ATTR_HOMEGW_DEV] != VALUE_HOMEGW_DEV_DIGOO:
-            return
-        if payload[ATTR_HOMEGW_CHANNEL] != self._channel:
-            return
-
-        _LOGGER.debug("%s : %s", self._channel, new_state.state)
-
-        self._current_temperature = float(payload[ATTR_HOMEGW_TEMPERATURE])
-        self._current_humidity = int(payload[ATTR_HOMEGW_HUMIDITY])
-        self._id = int(payload[ATTR_HOMEGW_ID])
-        self._channel = int(payload[ATTR_HOMEGW_CHANNEL])
-        self._battery = bool(payload[ATTR_HOMEGW_BATTERY])
-
         self.schedule_update_ha_state()
 
     @property
@@ -173,11 +268,23 @@ class HomeGWClimate(ClimateDevice):
         """Return the unit of measurement."""
         return self._unit_of_measurement
 
-    @property
     @Filter(FILTER_LOWPASS,
             window_size=1, precision=1, entity="temperature",time_constant=8)
     @Filter(FILTER_OUTLIER,
             window_size=3, precision=2, entity="temperature", radius=2.0)
+    def _filter_temperature(self, value):
+        """Filter a new temperature sample."""
+        return value
+
+    @Filter(FILTER_LOWPASS,
+            window_size=1, precision=1, entity="unnamed",time_constant=4)
+    @Filter(FILTER_OUTLIER,
+            window_size=3, precision=2, entity="unnamed", radius=3.0)
+    def _filter_humidity(self, value):
+        """Filter a new humidity sample."""
+        return value
+
+    @property
     def current_temperature(self):
         """Return the current temperature."""
         return self._current_temperature
@@ -188,10 +295,6 @@ class HomeGWClimate(ClimateDevice):
         return 21.0
 
     @property
-    @Filter(FILTER_LOWPASS,
-            window_size=1, precision=1, entity="unnamed",time_constant=4)
-    @Filter(FILTER_OUTLIER,
-            window_size=3, precision=2, entity="unnamed", radius=3.0)
     def current_humidity(self):
         """Return the current humidity."""
         return self._current_humidity
@@ -203,7 +306,14 @@ class HomeGWClimate(ClimateDevice):
 
     @property
     def device_state_attributes(self):
-        """Return the state attributes."""
+        """Return the state attributes, rendered once per sample."""
+        if self._attrs_version != self._version:
+            self._attrs = self._render_attributes()
+            self._attrs_version = self._version
+        return self._attrs
+
+    def _render_attributes(self):
+        """Build the state attributes."""
         attrs = {
             ATTR_CURRENT_TEMPERATURE: self.current_temperature,
             ATTR_CURRENT_HUMIDITY: self.current_humidity,
@@ -214,4 +324,6 @@ class HomeGWClimate(ClimateDevice):
             attrs[ATTR_HOMEGW_ID] = self._id
         if self._battery is not None:
             attrs[ATTR_HOMEGW_BATTERY] = self._battery
+        attrs[ATTR_EMITTED_UPDATES] = self._gate.emitted
+        attrs[ATTR_SUPPRESSED_UPDATES] = self._gate.suppressed
         return attrs
@@ -4,11 +4,12 @@ Home MQTT (https://github.com/dgomes/home_mqtt) platform for the cover component
 For more details about this platform, please refer to the documentation
 https://github.com/dgomes/home_mqtt
 """
+import json
 import logging
+from time import monotonic
 
 import voluptuous as vol
 
-from homeassistant.util import dt as dt_util
 from homeassistant.core import callback
 from homeassistant.components.cover import (
     CoverEntity, PLATFORM_SCHEMA,
@@ -26,12 +27,26 @@ _LOGGER = logging.getLogger(__name__)
 
 CONF_RELAY_UP = "relay_up"
 CONF_RELAY_DOWN = "relay_down"
+CONF_BATCH_TOPIC = "batch_topic"
+CONF_FRAME_RATE = "frame_rate"
+
+DEFAULT_FRAME_RATE = 2
+
+COMMAND_SETTLE = 0.5
+COMMAND_TIMEOUT = 5
+
+ATTR_QUEUE_DEPTH = "queue_depth"
+ATTR_COALESCED_COMMANDS = "coalesced_commands"
+ATTR_DROPPED_COMMANDS = "dropped_commands"
 
 ICON_OPEN = "mdi:blinds-open"
 ICON_CLOSE = "mdi:blinds"
 
 M_DUINO_RELAY = "devices/m-duino/relay/{}"
 M_DUINO_RELAY_SET = M_DUINO_RELAY + "/set"
+M_DUINO_RELAYS = M_DUINO_RELAY.format("+")
+
+DATA_RELAY_ROUTER = "homegw_relay_router"
 
 COVER_SCHEMA = vol.Schema({
     vol.Required(CONF_RELAY_UP): cv.positive_int,
@@ -41,6 +56,9 @@ COVER_SCHEMA = vol.Schema({
 
 PLATFORM_SCHEMA = PLATFORM_SCHEMA.extend({
     vol.Required(CONF_COVERS): vol.Schema({cv.slug: COVER_SCHEMA}),
+    vol.Optional(CONF_BATCH_TOPIC): cv.string,
+    vol.Optional(CONF_FRAME_RATE, default=DEFAULT_FRAME_RATE):
+        vol.All(vol.Coerce(float), vol.Range(min=0.1, max=25)),
 })
 
 
@@ -62,9 +80,164 @@ async def async_setup_platform(hass, config, async_add_entities, discovery_info=
         _LOGGER.error("No covers added")
         return
 
+    router = await async_get_relay_router(hass)
+    if CONF_BATCH_TOPIC in config:
+        router.batch_topic = config[CONF_BATCH_TOPIC]
+    router.ticker.interval = 1 / config[CONF_FRAME_RATE]
     async_add_entities(covers)
 
 
+async def async_get_relay_router(hass):
+    """Return the relay router shared by the covers."""
+    if DATA_RELAY_ROUTER not in hass.data:
+        hass.data[DATA_RELAY_ROUTER] = hass.async_create_task(
+            _async_subscribe_relay_router(hass))
+    return await hass.data[DATA_RELAY_ROUTER]
+
+
+async def _async_subscribe_relay_router(hass):
+    """Subscribe the relay router to all the m-duino relays."""
+    router = RelayRouter(hass)
+    await hass.components.mqtt.async_subscribe(
+        M_DUINO_RELAYS, router.message_received)
+    return router
+
+
+class MotionTicker(object):
+    """Interpolate the position of the moving covers.
+
+    One timer, on the monotonic loop clock, ticks every interval seconds
+    for all the covers moving and only while there is one.
+    """
+
+    def __init__(self, hass, interval=1 / DEFAULT_FRAME_RATE):
+        """Initialize the ticker."""
+        self._hass = hass
+        self._covers = set()
+        self._timer = None
+        self.interval = interval
+
+    @callback
+    def async_add(self, cover):
+        """Start interpolating the position of cover."""
+        self._covers.add(cover)
+        if self._timer is None:
+            self._timer = self._hass.loop.call_later(
+                self.interval, self._async_tick)
+
+    @callback
+    def async_remove(self, cover):
+        """Stop interpolating the position of cover."""
+        self._covers.discard(cover)
+        if not self._covers and self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+    @callback
+    def _async_tick(self):
+        """Update the position of every moving cover."""
+        now = monotonic()
+        for cover in self._covers:
+            cover.async_update_position(now)
+        loop = self._hass.loop
+        self._timer = loop.call_at(
+            max(self._timer.when() + self.interval, loop.time()),
+            self._async_tick)
+
+
+class RelayRouter(object):
+    """Route the m-duino relay messages to the covers.
+
+    One wildcard subscription serves all covers, each message is routed
+    with a lookup of its topic in a table of topic -> (cover, opening).
+
+    Covers moved in the same loop iteration (e.g. a group or an area) are
+    operated together: their relays are switched by one message to
+    batch_topic, {"relay": msec, ...}, if the m-duino firmware has one, or
+    back to back otherwise, and their states written afterwards.
+    """
+
+    def __init__(self, hass):
+        """Initialize the router."""
+        self._hass = hass
+        self._relays = {}
+        self._pending_relays = {}
+        self._pending_covers = []
+        self.batch_topic = None
+        self.ticker = MotionTicker(hass)
+
+    @callback
+    def async_register(self, cover):
+        """Route the relays of cover, returns a callback to unregister."""
+        topics = {M_DUINO_RELAY.format(cover.relay_up): True,
+                  M_DUINO_RELAY.format(cover.relay_down): False}
+        for topic, opening in topics.items():
+            if topic in self._relays:
+                _LOGGER.error("%s is used by %s and %s", topic,
+                              self._relays[topic][0].name, cover.name)
+            self._relays[topic] = (cover, opening)
+
+        @callback
+        def async_unregister():
+            """Stop routing the relays of cover."""
+            for topic in topics:
+                if self._relays.get(topic, (None,))[0] is cover:
+                    del self._relays[topic]
+
+        return async_unregister
+
+    @callback
+    def async_operate(self, cover, relay=None, time=None):
+        """Switch relay on for time msec and write the state of cover.
+
+        Both happen in the next loop iteration, with the other covers.
+        """
+        if not self._pending_covers:
+            self._hass.loop.call_soon(self._async_flush)
+        if relay is not None:
+            self._pending_relays[relay] = time
+        self._pending_covers.append(cover)
+
+    @callback
+    def async_cancel(self, relay):
+        """Drop relay from the relays to switch, returns True if it was in.
+
+        A relay not switched yet is cancelled this way, a stop published
+        right away would reach the m-duino before the move it cancels.
+        """
+        if relay not in self._pending_relays:
+            return False
+        del self._pending_relays[relay]
+        return True
+
+    @callback
+    def _async_flush(self):
+        """Switch the pending relays and write the states of their covers."""
+        relays, self._pending_relays = self._pending_relays, {}
+        covers, self._pending_covers = self._pending_covers, []
+        publish = self._hass.components.mqtt.async_publish
+
+        if self.batch_topic is not None and len(relays) > 1:
+            _LOGGER.debug("Switching relays %s", relays)
+            publish(self.batch_topic, json.dumps(relays), qos=0, retain=False)
+        else:
+            for relay, time in relays.items():
+                publish(M_DUINO_RELAY_SET.format(relay), time, qos=0,
+                        retain=False)
+
+        for cover in covers:
+            cover.async_schedule_update_ha_state(True)
+
+    @callback
+    def message_received(self, mqttmsg):
+        """Hand a relay message to its cover."""
+        route = self._relays.get(mqttmsg.topic)
+        if route is None:
+            return
+        cover, opening = route
+        cover.relay_changed(opening, mqttmsg.payload == "true")
+
+
 class HomeMQTTCover(CoverEntity, RestoreEntity):
     """Representation of a demo cover."""
 
@@ -80,7 +253,20 @@ class HomeMQTTCover(CoverEntity, RestoreEntity):
 
         self._closed = False
         self._position = 50
-        self._timer = None
+        self._move_start = None
+        self._move_from = None
+        self._move_direction = 0
+        self._target = None
+        self._queue_depth = 0
+        self._moving_relay = None
+        self._moving_to = None
+        self._stopping = False
+        self._settle_timer = None
+        self._command_timer = None
+        self._coalesced = 0
+        self._dropped = 0
+        self._router = None
+        self._remove_relays = None
 
     async def async_added_to_hass(self):
         """Call when entity about to be added to hass."""
@@ -90,46 +276,114 @@ class HomeMQTTCover(CoverEntity, RestoreEntity):
             _LOGGER.debug("last state of %s = %s", self._name, state)
             self._position = state.attributes.get('current_position', 50)
             
-        @callback
-        def update_status(mqttmsg):
-            if self._timer is not None:
-                elapsed_time = dt_util.utcnow() - self._timer
-                elapsed_miliseconds = int(elapsed_time.seconds * 1000 + elapsed_time.microseconds / 1000)
-                _LOGGER.debug("elapsed_miliseconds for %s = %s ", self._name, elapsed_miliseconds)
-                self._timer = None
-            else:
-                elapsed_miliseconds = 0
-            
-            if mqttmsg.topic == M_DUINO_RELAY.format(self._relay_up):
-                if mqttmsg.payload == "true":
-                    _LOGGER.debug("Opening %s", self._name)
-                    self._is_opening = True
-                    self._timer = dt_util.utcnow()
-                else:
-                    self._is_opening = False
-                    self._position+= int( (elapsed_miliseconds/self._delay_time) * 100 )
-            elif mqttmsg.topic == M_DUINO_RELAY.format(self._relay_down):
-                if mqttmsg.payload == "true":
-                    _LOGGER.debug("Closing %s", self._name)
-                    self._is_closing = True
-                    self._timer = dt_util.utcnow()
-                else:
-                    self._is_closing = False
-                    self._position-= int( (elapsed_miliseconds/self._delay_time) * 100 )
-           
-            self._closed = False
-            self._icon = ICON_OPEN
-            if self._position >= 99: #this accounts for timing errors
-                self._position = 100
-            elif self._position <= 1:
-                self._position = 0
-                self._closed = True
-                self._icon = ICON_CLOSE
+        self._router = await async_get_relay_router(self.hass)
+        self._remove_relays = self._router.async_register(self)
+
+    async def async_will_remove_from_hass(self):
+        """Stop routing the relay messages to the cover."""
+        await super().async_will_remove_from_hass()
+        self._remove_relays()
+        self._router.ticker.async_remove(self)
+        if self._settle_timer is not None:
+            self._settle_timer.cancel()
+        self._cancel_command_timer()
 
-            self.async_schedule_update_ha_state(True)
+    @property
+    def relay_up(self):
+        """Return the relay that opens the cover."""
+        return self._relay_up
 
-        await self.hass.components.mqtt.async_subscribe(M_DUINO_RELAY.format(self._relay_up), update_status)
-        await self.hass.components.mqtt.async_subscribe(M_DUINO_RELAY.format(self._relay_down), update_status)
+    @property
+    def relay_down(self):
+        """Return the relay that closes the cover."""
+        return self._relay_down
+
+    @callback
+    def relay_changed(self, opening, active):
+        """Handle the up (opening) or down relay switching on or off."""
+        now = monotonic()
+        if self._move_start is not None:
+            _LOGGER.debug("%s moved for %.3fs", self._name,
+                          now - self._move_start)
+            self._set_position(self._interpolate(now))
+            self._router.ticker.async_remove(self)
+            self._move_start = None
+
+        if opening:
+            self._is_opening = active
+        else:
+            self._is_closing = active
+        if active:
+            _LOGGER.debug("%s %s", "Opening" if opening else "Closing",
+                          self._name)
+            self._move_start = now
+            self._move_from = self._position
+            self._move_direction = 1 if opening else -1
+            self._router.ticker.async_add(self)
+
+        self._set_position(self._position)
+        if not (self._is_opening or self._is_closing):
+            self._cancel_command_timer()
+            self._moving_relay = self._moving_to = None
+            self._stopping = False
+            if self._target is not None:
+                self._settle()
+        self.async_schedule_update_ha_state(True)
+
+    def _expect_relays(self, time):
+        """Give up waiting for the relays COMMAND_TIMEOUT after time msec."""
+        self._cancel_command_timer()
+        self._command_timer = self.hass.loop.call_later(
+            time / 1000 + COMMAND_TIMEOUT, self._command_timed_out)
+
+    def _cancel_command_timer(self):
+        """Stop waiting for the relays."""
+        if self._command_timer is not None:
+            self._command_timer.cancel()
+            self._command_timer = None
+
+    @callback
+    def _command_timed_out(self):
+        """Take the cover as stopped, a relay message got lost."""
+        self._command_timer = None
+        _LOGGER.warning("%s: no relay message for the last command, taking "
+                        "the cover as stopped", self._name)
+        if self._move_start is not None:
+            self._set_position(self._interpolate(monotonic()))
+            self._router.ticker.async_remove(self)
+            self._move_start = None
+        self._is_opening = self._is_closing = False
+        self._moving_relay = self._moving_to = None
+        self._stopping = False
+        if self._target is not None:
+            self._settle()
+        self.async_schedule_update_ha_state(True)
+
+    def _interpolate(self, now):
+        """Return the position of the moving cover at now."""
+        position = self._move_from + self._move_direction * int(
+            (now - self._move_start) * 100000 / self._delay_time)
+        return min(100, max(0, position))
+
+    def _set_position(self, position):
+        """Set the position, icon and closed state."""
+        self._closed = False
+        self._icon = ICON_OPEN
+        if position >= 99: #this accounts for timing errors
+            position = 100
+        elif position <= 1:
+            position = 0
+            self._closed = True
+            self._icon = ICON_CLOSE
+        self._position = position
+
+    @callback
+    def async_update_position(self, now):
+        """Show the cover moving, called by the MotionTicker."""
+        position = self._interpolate(now)
+        if position != self._position:
+            self._set_position(position)
+            self.async_schedule_update_ha_state()
 
     @property
     def name(self):
@@ -151,15 +405,101 @@ class HomeMQTTCover(CoverEntity, RestoreEntity):
         position = kwargs.get(ATTR_POSITION)
         _LOGGER.debug("set position %s = %s", self._name, position)
 
-        diff = self._position - position
+        if self._target is not None:
+            self._coalesced += 1
+        self._target = position
+        self._queue_depth += 1
+        if self._settle_timer is not None:
+            self._settle()
+        else:
+            self._process_commands()
+
+    def _settle(self):
+        """Move to the target once no command came for COMMAND_SETTLE."""
+        if self._settle_timer is not None:
+            self._settle_timer.cancel()
+        self._settle_timer = self.hass.loop.call_later(
+            COMMAND_SETTLE, self._settled)
+
+    @callback
+    def _settled(self):
+        """Move to the target of the last command."""
+        self._settle_timer = None
+        if self._target is not None:
+            self._process_commands()
+
+    def _process_commands(self):
+        """Move the cover to the latest target.
+
+        A moving cover is stopped first, the target is then reached with
+        one move from wherever the cover stopped, once commands stop coming
+        (COMMAND_SETTLE). Targets received in the meantime replace it.
+        Relay messages that do not come within the move time and
+        COMMAND_TIMEOUT are given up on, so a lost one does not block the
+        cover.
+        """
+        target = self._target
+        moving = self._is_opening or self._is_closing
+        if self._moving_to is not None or moving:
+            if target == self._moving_to:
+                self._drop_commands()
+                return
+            if not moving and self._router.async_cancel(self._moving_relay):
+                _LOGGER.debug("Replacing the move of %s before it was sent",
+                              self._name)
+                self._cancel_command_timer()
+                self._moving_relay = self._moving_to = None
+            else:
+                if not self._stopping:
+                    _LOGGER.debug("Stopping %s to go to %s", self._name,
+                                  target)
+                    self._stopping = True
+                    self._stop_relays([self._moving_relay or (
+                        self._relay_up if self._is_opening
+                        else self._relay_down)])
+                    if moving:
+                        # Otherwise the timer of the move still runs
+                        self._expect_relays(0)
+                return
+
+        self._target = None
+        self._queue_depth = 0
+        diff = self._position - target
         if diff > 0:
             _LOGGER.debug("Close")
             self._operate_cover(self._relay_down, diff * self._delay_time / 100)
         elif diff < 0:
             _LOGGER.debug("Open")
             self._operate_cover(self._relay_up, abs(diff) * self._delay_time / 100)
-        self._position = position
-        self.async_schedule_update_ha_state(True)
+        else:
+            self._dropped += 1
+            self._router.async_operate(self)
+            return
+        self._moving_to = target
+
+    def _drop_commands(self):
+        """Drop the commands waiting, the cover is already going there."""
+        self._dropped += 1
+        self._target = None
+        self._queue_depth = 0
+        if self._settle_timer is not None:
+            self._settle_timer.cancel()
+            self._settle_timer = None
+        self.async_schedule_update_ha_state()
+
+    def _stop_relays(self, relays):
+        """Switch relays off, returns True if a stop was published.
+
+        Relays not switched yet by the router are just dropped from it.
+        """
+        published = False
+        for relay in relays:
+            if self._router.async_cancel(relay):
+                continue
+            self.hass.components.mqtt.async_publish(
+                M_DUINO_RELAY_SET.format(relay), "false", qos=0, retain=False)
+            published = True
+        return published
 
     @property
     def should_poll(self):
@@ -193,14 +533,11 @@ class HomeMQTTCover(CoverEntity, RestoreEntity):
 
     def _operate_cover(self, relay, time):
         time = int(time)
-        if self._is_closing or self._is_opening:
-            _LOGGER.error("Can't operate cover %s", self._name)
-            return
-
         _LOGGER.debug("_operate_cover %s @ %s for %s msec ", self._name, relay, time)
 
-        self.hass.components.mqtt.async_publish(
-            M_DUINO_RELAY_SET.format(relay), time, qos=0, retain=False)
+        self._moving_relay = relay
+        self._router.async_operate(self, relay, time)
+        self._expect_relays(time)
 
     async def async_close_cover(self, **kwargs):
         """Close the cover."""
@@ -214,17 +551,33 @@ class HomeMQTTCover(CoverEntity, RestoreEntity):
         
     async def async_stop_cover(self, **kwargs):
         """Stop the cover."""
+        if self._target is not None:
+            self._drop_commands()
         relays = []
         if self._is_opening:
             relays = [self._relay_up, self._relay_down]
         elif self._is_closing:
             relays = [self._relay_down, self._relay_up]
+        elif self._moving_relay is not None:
+            relays = [self._moving_relay]
         else:
             self._position = 50
             self._closed = False
-            self._timer = None
             self.async_schedule_update_ha_state(True)
-        
-        for r in relays:
-            self.hass.components.mqtt.async_publish(
-                M_DUINO_RELAY_SET.format(r), "false", qos=0, retain=False)
+
+        moving = self._is_opening or self._is_closing
+        self._moving_relay = self._moving_to = None
+        self._stopping = False
+        if not self._stop_relays(relays):
+            self._cancel_command_timer()
+        elif moving:
+            self._expect_relays(0)
+
+    @property
+    def device_state_attributes(self):
+        """Return the command queue counters."""
+        return {
+            ATTR_QUEUE_DEPTH: self._queue_depth,
+            ATTR_COALESCED_COMMANDS: self._coalesced,
+            ATTR_DROPPED_COMMANDS: self._dropped,
+        }
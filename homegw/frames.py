@@ -0,0 +1,184 @@
+"""
+Decoder of the HomeGW gateway frames.
+
+The gateway prints one flat JSON object per 433MHz frame, always with the
+same keys in the same order, e.g.:
+
+{"dev":"digoo","id":8,"ch":3,"batt":1,"temp":20,"hum":56,"raw":"0x8a0c8f38"}
+
+Frames are decoded into a slotted Frame. Frames in that layout are parsed
+with a single regular expression, anything else goes through orjson when
+installed (json otherwise) and is checked against the known frame shapes.
+Malformed frames raise ValueError.
+
+FrameRecorder appends the raw frames, with the time they were received, to
+a log that read_log plays back (benchmarks/homegw_replay.py). The log is a
+LOG_MAGIC header followed by a LOG_RECORD (time, length) and the UTF-8 frame
+per record, written by a thread of its own so recording never blocks the
+event loop. No Home Assistant dependency, so it can be benchmarked alone.
+"""
+import queue
+import re
+import struct
+import threading
+
+try:
+    from orjson import loads
+except ImportError:
+    from json import loads
+
+LOG_MAGIC = b'HOMEGW\x01\n'
+LOG_RECORD = struct.Struct('<dH')
+LOG_BUFFER_SIZE = 64 * 1024
+
+ATTR_HOMEGW_DEV = 'dev'
+ATTR_HOMEGW_ID = 'id'
+ATTR_HOMEGW_CHANNEL = 'ch'
+ATTR_HOMEGW_BATTERY = 'batt'
+ATTR_HOMEGW_TEMPERATURE = 'temp'
+ATTR_HOMEGW_HUMIDITY = 'hum'
+ATTR_HOMEGW_PRESSURE = 'pressure'
+
+MEASUREMENT_FIELDS = (ATTR_HOMEGW_ID, ATTR_HOMEGW_CHANNEL, ATTR_HOMEGW_BATTERY,
+                      ATTR_HOMEGW_TEMPERATURE, ATTR_HOMEGW_HUMIDITY)
+
+# Fields a frame of these devices must carry to be accepted
+SCHEMAS = {
+    'digoo': MEASUREMENT_FIELDS,
+    'weather': MEASUREMENT_FIELDS,
+}
+
+FRAME_RE = re.compile(
+    r'\{"dev":"(\w+)","id":(\d+),"ch":(\d+),"batt":([01]),'
+    r'"temp":(-?\d+(?:\.\d+)?),"hum":(\d+)'
+    r'(?:,"pressure":(\d+))?(?:,"raw":"[^"\\]*")?\}')
+
+
+class Frame(object):
+    """A decoded gateway frame, fields missing from the frame are None."""
+
+    __slots__ = ('dev', 'id', 'ch', 'batt', 'temp', 'hum', 'pressure')
+
+    def __init__(self, dev, id=None, ch=None, batt=None, temp=None, hum=None,
+                 pressure=None):
+        """Initialize the frame."""
+        self.dev = dev
+        self.id = id
+        self.ch = ch
+        self.batt = batt
+        self.temp = temp
+        self.hum = hum
+        self.pressure = pressure
+
+    def __eq__(self, other):
+        """Compare all fields."""
+        return (isinstance(other, Frame) and
+                all(getattr(self, field) == getattr(other, field)
+                    for field in self.__slots__))
+
+    def __repr__(self):
+        """Return the fields that are set."""
+        return "Frame({})".format(", ".join(
+            "{}={!r}".format(field, getattr(self, field))
+            for field in self.__slots__ if getattr(self, field) is not None))
+
+
+def _optional(payload, key, convert):
+    """Return payload[key] converted, None if missing."""
+    value = payload.get(key)
+    if value is None:
+        return None
+    if not isinstance(value, (int, float)):
+        raise ValueError("{} is not a number".format(key))
+    return convert(value)
+
+
+def frame_from_payload(payload):
+    """Return the Frame of a decoded JSON payload, raises ValueError."""
+    if not isinstance(payload, dict):
+        raise ValueError("Not an object")
+    dev = payload.get(ATTR_HOMEGW_DEV)
+    if not isinstance(dev, str):
+        raise ValueError("No dev")
+    for field in SCHEMAS.get(dev, ()):
+        if field not in payload:
+            raise ValueError("Missing {}".format(field))
+    return Frame(
+        dev,
+        _optional(payload, ATTR_HOMEGW_ID, int),
+        _optional(payload, ATTR_HOMEGW_CHANNEL, int),
+        _optional(payload, ATTR_HOMEGW_BATTERY, bool),
+        _optional(payload, ATTR_HOMEGW_TEMPERATURE, float),
+        _optional(payload, ATTR_HOMEGW_HUMIDITY, int),
+        _optional(payload, ATTR_HOMEGW_PRESSURE, int))
+
+
+def decode(raw, loads=loads):
+    """Return the Frame of raw (str), raises ValueError if malformed.
+
+    Frames in the gateway layout are parsed by FRAME_RE alone, anything else
+    is decoded with loads and checked against SCHEMAS.
+    """
+    match = FRAME_RE.fullmatch(raw)
+    if match is None:
+        return frame_from_payload(loads(raw))
+    dev, id, ch, batt, temp, hum, pressure = match.groups()
+    return Frame(dev, int(id), int(ch), batt == '1', float(temp), int(hum),
+                 None if pressure is None else int(pressure))
+
+
+class FrameRecorder(object):
+    """Append frames to a log.
+
+    record only queues the frame, a writer thread packs and writes the
+    queue. Writes are buffered (LOG_BUFFER_SIZE), a record cut short by a
+    crash is ignored by read_log.
+    """
+
+    def __init__(self, path):
+        """Open the log for appending and start the writer."""
+        self._file = open(path, 'ab', buffering=LOG_BUFFER_SIZE)
+        if self._file.tell() == 0:
+            self._file.write(LOG_MAGIC)
+        self._queue = queue.SimpleQueue()
+        self._writer = threading.Thread(
+            target=self._write, name='homegw-recorder', daemon=True)
+        self._writer.start()
+        self.records = 0
+
+    def record(self, timestamp, raw):
+        """Queue raw (str) received at timestamp (seconds since epoch)."""
+        self._queue.put((timestamp, raw))
+        self.records += 1
+
+    def _write(self):
+        """Write the queued records until close queues None."""
+        while True:
+            record = self._queue.get()
+            if record is None:
+                return
+            timestamp, raw = record
+            data = raw.encode('utf-8')[:0xffff]
+            self._file.write(LOG_RECORD.pack(timestamp, len(data)) + data)
+
+    def close(self):
+        """Write the queued records, flush and close the log (blocks)."""
+        self._queue.put(None)
+        self._writer.join()
+        self._file.close()
+
+
+def read_log(path):
+    """Yield the (timestamp, raw) records of a log."""
+    with open(path, 'rb') as log_file:
+        if log_file.read(len(LOG_MAGIC)) != LOG_MAGIC:
+            raise ValueError("{} is not a HomeGW log".format(path))
+        while True:
+            header = log_file.read(LOG_RECORD.size)
+            if len(header) < LOG_RECORD.size:
+                return
+            timestamp, length = LOG_RECORD.unpack(header)
+            data = log_file.read(length)
+            if len(data) < length:
+                return
+            yield timestamp, data.decode('utf-8', errors='replace')
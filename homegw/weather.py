@@ -5,31 +5,48 @@ https://github.com/dgomes/homeGW
 """
 import asyncio
 import logging
-import json
+from datetime import timedelta
 import voluptuous as vol
 
 from homeassistant.components.weather import (
     WeatherEntity)
 from homeassistant.const import (
-    TEMP_CELSIUS, CONF_NAME, STATE_UNKNOWN, STATE_UNAVAILABLE)
+    TEMP_CELSIUS, CONF_NAME, STATE_UNKNOWN, SUN_EVENT_SUNRISE,
+    SUN_EVENT_SUNSET)
 from homeassistant.core import callback
+from homeassistant.helpers.dispatcher import async_dispatcher_connect
+from homeassistant.helpers.event import async_track_point_in_utc_time
 from homeassistant.components.weather import (
     PLATFORM_SCHEMA)
 import homeassistant.helpers.config_validation as cv
-from homeassistant.helpers.event import async_track_state_change
 from homeassistant.helpers.restore_state import RestoreEntity 
-from homeassistant.helpers.sun import is_up
+from homeassistant.helpers.sun import get_astral_event_next, is_up
 
 import os
 import sys
 sys.path.append(os.sep.join(os.path.abspath(__file__).split(os.sep)[:-2]))
-from filter_helper import Filter, FILTER_OUTLIER
+from filter_helper import Filter, EmissionGate, FILTER_OUTLIER
+
+from . import (
+    DOMAIN, DATA_HUB, SIGNAL_NEW_DEVICE, async_get_dispatcher,
+    async_get_filter_store)
 
 
 _LOGGER = logging.getLogger(__name__)
 
 CONF_SERIAL_ENTITY = "serial_sensor"
+CONF_DEADBAND = 'deadband'
+CONF_ABSOLUTE = 'absolute'
+CONF_RELATIVE = 'relative'
+CONF_MIN_INTERVAL = 'min_interval'
+CONF_MAX_INTERVAL = 'max_interval'
+
 DEFAULT_NAME = "HomeGW Weather Station"
+DEFAULT_MAX_INTERVAL = timedelta(minutes=10)
+
+MEASUREMENT_TEMPERATURE = 'temperature'
+MEASUREMENT_HUMIDITY = 'humidity'
+MEASUREMENT_PRESSURE = 'pressure'
 
 ATTR_HOMEGW_DEV = 'dev'
 ATTR_HOMEGW_TEMPERATURE = 'temp'
@@ -38,38 +55,87 @@ ATTR_HOMEGW_PRESSURE = 'pressure'
 ATTR_HOMEGW_ID = 'id'
 ATTR_HOMEGW_CHANNEL = 'ch'
 ATTR_HOMEGW_BATTERY = 'batt'
+ATTR_EMITTED_UPDATES = 'emitted_updates'
+ATTR_SUPPRESSED_UPDATES = 'suppressed_updates'
 
 VALUE_HOMEGW_DEV_WEATHER = 'weather'
 
+DEADBAND_SCHEMA = vol.Schema({
+    vol.Optional(CONF_ABSOLUTE, default=0): vol.Coerce(float),
+    vol.Optional(CONF_RELATIVE, default=0): vol.Coerce(float),
+})
+
 PLATFORM_SCHEMA = PLATFORM_SCHEMA.extend({
-    vol.Required(CONF_SERIAL_ENTITY): cv.entity_id,
+    vol.Optional(CONF_SERIAL_ENTITY): cv.entity_id,
     vol.Optional(CONF_NAME, default=DEFAULT_NAME): cv.string,
+    vol.Optional(CONF_DEADBAND, default={}): vol.Schema({
+        vol.Optional(MEASUREMENT_TEMPERATURE): DEADBAND_SCHEMA,
+        vol.Optional(MEASUREMENT_HUMIDITY): DEADBAND_SCHEMA,
+        vol.Optional(MEASUREMENT_PRESSURE): DEADBAND_SCHEMA,
+    }),
+    vol.Optional(CONF_MIN_INTERVAL, default=timedelta(0)): cv.time_period,
+    vol.Optional(CONF_MAX_INTERVAL,
+                 default=DEFAULT_MAX_INTERVAL): cv.time_period,
 })
 
 
 async def async_setup_platform(hass, config, async_add_devices, discovery_info=None):
     """Set up the homeGW weather."""
+    if discovery_info is not None:
+        remove_listener = None
+
+        @callback
+        def async_new_device(dev, channel):
+            """Add the weather station once it is heard."""
+            if dev != VALUE_HOMEGW_DEV_WEATHER:
+                return
+            remove_listener()
+            async_add_devices([
+                HomeGWWeather(hass, DEFAULT_NAME, None,
+                              EmissionGate(max_interval=DEFAULT_MAX_INTERVAL
+                                           .total_seconds()))
+            ])
+
+        remove_listener = async_dispatcher_connect(
+            hass, SIGNAL_NEW_DEVICE, async_new_device)
+        return
+
     name = config.get(CONF_NAME, DEFAULT_NAME)
     serial_sensor = config.get(CONF_SERIAL_ENTITY)
+    if serial_sensor is None and DATA_HUB not in hass.data.get(DOMAIN, {}):
+        _LOGGER.error("No serial_sensor given and %s is not configured",
+                      DOMAIN)
+        return
+    gate = EmissionGate(
+        {measurement: (deadband[CONF_ABSOLUTE], deadband[CONF_RELATIVE])
+         for measurement, deadband in config[CONF_DEADBAND].items()},
+        config[CONF_MIN_INTERVAL].total_seconds(),
+        config[CONF_MAX_INTERVAL].total_seconds())
 
     async_add_devices([
-        HomeGWWeather(hass, name, serial_sensor)
+        HomeGWWeather(hass, name, serial_sensor, gate)
     ])
 
 
 class HomeGWWeather(WeatherEntity, RestoreEntity):
     """Representation of a weather condition."""
 
-    def __init__(self, hass, name, serial_sensor):
+    def __init__(self, hass, name, serial_sensor, gate):
         """Initialize the HomeGW weather."""
         self._name = name
+        self._gate = gate
+        self._dispatcher = None
         self._hass = hass
         self._temperature = None
         self._humidity = None
         self._pressure = None
         self._channel = self._id = self._battery = None
+        self._sun_up = None
+        self._version = 0
+        self._attrs = self._attrs_version = None
+        self._remove_sun_listener = None
 
-        async_track_state_change(hass, serial_sensor, self._sensor_changed)
+        self._serial_sensor = serial_sensor
 
     async def async_added_to_hass(self):
         """Run when entity about to be added."""
@@ -86,31 +152,89 @@ class HomeGWWeather(WeatherEntity, RestoreEntity):
                 self._pressure = int(
                     old_state.attributes[ATTR_HOMEGW_PRESSURE])
 
-    @callback
-    def _sensor_changed(self, entity_id, old_state, new_state):
-        """Handle sensor state changes."""
-        if new_state is None:
-            return
-        elif new_state.state in [STATE_UNKNOWN, STATE_UNAVAILABLE]:
-            return
+        self._version += 1
 
-        try:
-            payload = json.loads(new_state.state)
-        except Exception:
-            _LOGGER.warning("Could not process: %s", new_state.state)
-            return
+        filter_store = await async_get_filter_store(self.hass)
+        snapshot = filter_store.async_restore(self.entity_id)
+        if snapshot is not None:
+            Filter.restore(self.entity_id, *snapshot)
+        self._remove_snapshots = filter_store.async_register(
+            self.entity_id, lambda: Filter.snapshot(self.entity_id))
 
-        if payload[ATTR_HOMEGW_DEV] != VALUE_HOMEGW_DEV_WEATHER:
-            return
+        dispatcher = self._dispatcher = async_get_dispatcher(
+            self.hass, self._serial_sensor)
+        self._remove_listener = dispatcher.async_register(
+            VALUE_HOMEGW_DEV_WEATHER, None, self._sensor_changed,
+            HomeGWWeather._sensors_changed)
 
-        self._temperature = float(payload[ATTR_HOMEGW_TEMPERATURE])
-        self._humidity = int(payload[ATTR_HOMEGW_HUMIDITY])
-        self._id = int(payload[ATTR_HOMEGW_ID])
-        self._channel = int(payload[ATTR_HOMEGW_CHANNEL])
-        self._battery = bool(payload[ATTR_HOMEGW_BATTERY])
+        self._track_sun(is_up(self.hass))
 
-        if payload.get(ATTR_HOMEGW_PRESSURE) is not None:
-            self._pressure = int(payload[ATTR_HOMEGW_PRESSURE])/100 #unit hPa
+    async def async_will_remove_from_hass(self):
+        """Run when entity will be removed."""
+        await super().async_will_remove_from_hass()
+        self._remove_listener()
+        self._remove_snapshots()
+        self._remove_sun_listener()
+        Filter.evict(self.entity_id)
+
+    @callback
+    def _track_sun(self, sun_up):
+        """Keep the sun state until the next sunrise or sunset."""
+        self._sun_up = sun_up
+        next_change = get_astral_event_next(
+            self.hass, SUN_EVENT_SUNSET if sun_up else SUN_EVENT_SUNRISE)
+        self._remove_sun_listener = async_track_point_in_utc_time(
+            self.hass, self._sun_changed, next_change)
+
+    @callback
+    def _sun_changed(self, now):
+        """Flip the condition at sunrise and sunset."""
+        self._track_sun(not self._sun_up)
+        self.schedule_update_ha_state()
+
+    @callback
+    def _sensor_changed(self, frame):
+        """Handle a frame of the weather station."""
+        timestamp = self._dispatcher.clock()
+        self._frame_filtered(
+            frame, self._filter_temperature(frame.temp, timestamp),
+            self._filter_humidity(frame.hum, timestamp), timestamp)
+
+    @classmethod
+    def _sensors_changed(cls, burst):
+        """Handle a burst of frames, filtering all stations at once."""
+        entities = [sensor_changed.__self__ for sensor_changed, _ in burst]
+        timestamp = entities[0]._dispatcher.clock()
+        entity_ids = [entity.entity_id for entity in entities]
+        timestamps = [timestamp] * len(burst)
+        temperatures = cls._filter_temperature.filter.filter_many(
+            entity_ids, [frame.temp for _, frame in burst], timestamps)
+        humidities = cls._filter_humidity.filter.filter_many(
+            entity_ids, [frame.hum for _, frame in burst], timestamps)
+        for entity, (_, frame), temperature, humidity in zip(
+                entities, burst, temperatures, humidities):
+            entity._frame_filtered(frame, temperature, humidity, timestamp)
+
+    def _frame_filtered(self, frame, temperature, humidity, timestamp):
+        """Take a frame with its filtered measurements."""
+        self._version += 1
+        self._temperature = temperature
+        self._humidity = humidity
+        self._id = frame.id
+        self._channel = frame.ch
+        self._battery = frame.batt
+
+        if frame.pressure is not None:
+            self._pressure = frame.pressure/100 #unit hPa
+
+        if not self._gate.check({
+                MEASUREMENT_TEMPERATURE: self._temperature,
+                MEASUREMENT_HUMIDITY: self._humidity,
+                MEASUREMENT_PRESSURE: self._pressure,
+                ATTR_HOMEGW_ID: self._id,
+                ATTR_HOMEGW_CHANNEL: self._channel,
+                ATTR_HOMEGW_BATTERY: self._battery}, timestamp):
+            return
 
         self.schedule_update_ha_state()
 
@@ -124,9 +248,19 @@ class HomeGWWeather(WeatherEntity, RestoreEntity):
         """No polling needed for a demo weather condition."""
         return False
 
-    @property
     @Filter(FILTER_OUTLIER,
             window_size=3, precision=2, entity="unnamed", radius=2.0)
+    def _filter_temperature(self, value):
+        """Filter a new temperature sample."""
+        return value
+
+    @Filter(FILTER_OUTLIER,
+            window_size=3, precision=2, entity="unnamed", radius=5.0)
+    def _filter_humidity(self, value):
+        """Filter a new humidity sample."""
+        return value
+
+    @property
     def temperature(self):
         """Return the temperature."""
         return self._temperature
@@ -137,8 +271,6 @@ class HomeGWWeather(WeatherEntity, RestoreEntity):
         return TEMP_CELSIUS
 
     @property
-    @Filter(FILTER_OUTLIER,
-            window_size=3, precision=2, entity="unnamed", radius=5.0)
     def humidity(self):
         """Return the humidity."""
         return self._humidity
@@ -155,7 +287,14 @@ class HomeGWWeather(WeatherEntity, RestoreEntity):
 
     @property
     def device_state_attributes(self):
-        """Return the state attributes."""
+        """Return the state attributes, rendered once per sample."""
+        if self._attrs_version != self._version:
+            self._attrs = self._render_attributes()
+            self._attrs_version = self._version
+        return self._attrs
+
+    def _render_attributes(self):
+        """Build the state attributes."""
         attrs = super().state_attributes
 
         if self._channel is not None:
@@ -164,6 +303,8 @@ class HomeGWWeather(WeatherEntity, RestoreEntity):
             attrs[ATTR_HOMEGW_ID] = self._id
         if self._battery is not None:
             attrs[ATTR_HOMEGW_BATTERY] = self._battery
+        attrs[ATTR_EMITTED_UPDATES] = self._gate.emitted
+        attrs[ATTR_SUPPRESSED_UPDATES] = self._gate.suppressed
         return attrs
 
     @property
@@ -174,6 +315,6 @@ class HomeGWWeather(WeatherEntity, RestoreEntity):
 
         if self._humidity > 80:
             return 'rainy'
-        if is_up(self._hass):
+        if self._sun_up:
             return 'sunny'
         return 'clear-night' 